@@ -0,0 +1,59 @@
+# MIT License
+
+# Copyright (c) 2023 ElliotCS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+""" Measures the interpreter's dispatch cost per instruction. Run: python benchmarks/bench_actions.py """
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from time import perf_counter
+from actions import compile_actions, run
+
+
+def nothing(*args) -> None:
+    pass
+
+
+def main(rounds: int = 20) -> None:
+    program = compile_actions([
+        'repeat 1000',
+        'say What a save!',
+        'hold Shift 0',
+        'type Nice shot.',
+        'end',
+    ], chat_opener_keycode=20)
+
+    # REPEAT runs once, the body and its NEXT run once per iteration
+    instructions = (len(program) - 1) * 1000 + 1
+
+    best = float('inf')
+    for _ in range(rounds):
+        start = perf_counter()
+        run(program, nothing, nothing, nothing, nothing)
+        best = min(best, perf_counter() - start)
+
+    print(f'{instructions} instructions in {best * 1000:.2f} ms, {best / instructions * 1e9:.0f} ns per instruction')
+
+
+if __name__ == '__main__':
+    main()
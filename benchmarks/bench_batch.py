@@ -0,0 +1,95 @@
+# MIT License
+
+# Copyright (c) 2023 ElliotCS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+    Checks that loading a config and bulk-importing into a live, indexed Macros scale
+    linearly: the time per macro at the largest size must stay within `slack` times the
+    time per macro at the smallest. Run: python benchmarks/bench_batch.py [slack]
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import logging
+from time import perf_counter
+from keycodes import scan_keynames
+from macros import Macro, Macros
+from search import MacroIndex
+
+KEYS = sorted(scan_keynames)
+SIZES = (500, 2000, 8000)  # 8000 is about every menu and key combination there is
+
+
+def config(size: int) -> dict:
+    data = {}
+    for menu in KEYS:
+        for key in KEYS:
+            if key == menu:
+                continue
+            if len(data) == size:
+                return data
+            data[f'macro {menu} {key}'] = {'menu_keycode': menu, 'activation_keycode': key, 'text': f'Quick chat {menu} {key}'}
+    return data
+
+
+def load(data: dict) -> float:
+    start = perf_counter()
+    Macros(None, data=data)
+    return perf_counter() - start
+
+
+def bulk_import(data: dict) -> float:
+    """ An import into macros the editor is showing, so the search index listens. """
+    macros = Macros(None)
+    index = MacroIndex(macros)
+    new = [Macro(name, entry) for name, entry in data.items()]
+    start = perf_counter()
+    with macros.batch():
+        for macro in new:
+            macros.insert_macro(macro)
+    elapsed = perf_counter() - start
+    index.close()
+    return elapsed
+
+
+def main(slack: float = 2.0) -> None:
+    logging.disable(logging.CRITICAL)
+    failed = False
+    for name, measure in (('load', load), ('import', bulk_import)):
+        per_macro = []
+        for size in SIZES:
+            data = config(size)
+            best = min(measure(data) for _ in range(3))
+            per_macro.append(best / size)
+            print(f'{name:6} {size:5} macros in {best * 1000:7.1f} ms, {best / size * 1e6:5.1f} us per macro')
+        if per_macro[-1] > per_macro[0] * slack:
+            print(f'FAIL {name} is not linear, {per_macro[-1] / per_macro[0]:.1f}x slower per macro at {SIZES[-1]} than at {SIZES[0]}')
+            failed = True
+    if failed:
+        sys.exit(1)
+    print(f'OK within {slack}x per macro')
+
+
+if __name__ == '__main__':
+    main(*map(float, sys.argv[1:]))
@@ -0,0 +1,102 @@
+# MIT License
+
+# Copyright (c) 2023 ElliotCS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+""" Feeds input_event records through the evdev reader from a pipe, as a keyboard would. Run (Linux): python benchmarks/bench_evdev.py [events] """
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import logging
+import tempfile
+import time
+from engine import Engine
+from linuxinput import EvdevBackend, pack_event
+from macros import Macros
+import metrics
+
+EV_SYN = 0
+
+
+def wait_for(condition, timeout: float = 10.0) -> None:
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out waiting for the evdev reader'
+        time.sleep(0.001)
+
+
+def check_scan() -> None:
+    """ Files that aren't keyboards are opened once, then remembered until they go away. """
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'event0')
+        open(path, 'w').close()
+        backend = EvdevBackend(os.path.join(directory, 'event*'))
+        backend.scan()
+        assert backend.rejected == {path} and not backend.devices, 'a non-keyboard is turned down'
+        os.remove(path)
+        backend.scan()
+        assert not backend.rejected, 'and forgotten once it is gone'
+        backend.close()
+    print('scan OK')
+
+
+def main(events: int = 200_000) -> None:
+    logging.disable(logging.CRITICAL)
+    check_scan()
+
+    data = {
+        f'macro {i}': {'menu_keycode': 2 + i // 4, 'activation_keycode': 2 + i % 4, 'text': f'Quick chat {i}'}
+        for i in range(16)
+    }
+    backend = EvdevBackend(None)
+    engine = Engine(Macros(None, data=data), backend)
+    engine.macros.scheduler.submit = lambda macro: None  # measure the reader and hook, not playback
+    read_end, write_end = os.pipe()
+    backend.add_device(read_end, 'pipe')
+    engine.start()
+
+    # Like a real keyboard, every key event is followed by a sync report. 30 is no macro's key
+    pattern = [(2, 1), (2, 0), (3, 1), (3, 0), (30, 1), (30, 0), (4, 1), (4, 2), (4, 0)]
+    records = b''.join(pack_event(code, value) + pack_event(0, 0, EV_SYN) for code, value in pattern)
+    rounds = events // len(pattern)
+    unwatched = 2 * rounds
+    seen = metrics.hook_events.value + rounds * len(pattern)
+
+    start = time.perf_counter()
+    for _ in range(rounds):
+        os.write(write_end, records)
+    wait_for(lambda: metrics.hook_events.value >= seen)
+    elapsed = time.perf_counter() - start
+
+    assert metrics.hook_filtered.value == unwatched, f'{metrics.hook_filtered.value} of {unwatched} unwatched events counted as filtered'
+    count = rounds * len(pattern)
+    print(f'{count} key events in {elapsed:.3f} s, {count / elapsed:,.0f} per second, {unwatched} filtered in the reader')
+
+    os.close(write_end)
+    wait_for(lambda: not backend.devices)  # end of file is an unplugged device
+    engine.stop()
+    assert backend.thread is None, 'stopping the engine closes the backend'
+    print('unplug and close OK')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
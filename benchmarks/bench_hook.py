@@ -0,0 +1,61 @@
+# MIT License
+
+# Copyright (c) 2023 ElliotCS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+""" Measures the time the hook thread spends per key event. Run: python benchmarks/bench_hook.py [events] """
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import logging
+from backends import FakeBackend
+from engine import Engine
+from macros import Macros
+import metrics
+
+
+def main(events: int = 100_000) -> None:
+    logging.disable(logging.CRITICAL)
+    data = {
+        f'macro {i}': {'menu_keycode': 2 + i // 4, 'activation_keycode': 2 + i % 4, 'text': f'Quick chat {i}'}
+        for i in range(16)
+    }
+    backend = FakeBackend()
+    engine = Engine(Macros(None, data=data), backend)
+    engine.macros.scheduler.submit = lambda macro: None  # measure the hook, not playback
+    engine.start()
+
+    # Menus opening and closing, unwatched keys, and repeats from held keys
+    pattern = [(2, True), (2, False), (3, True), (3, False), (30, True), (30, False), (4, True), (4, True), (4, False)]
+    for i in range(events):
+        backend.feed(*pattern[i % len(pattern)])
+        if len(engine.menu_events) > 64:
+            engine.menu_events.clear()  # what the Tk thread does every frame
+
+    summary = metrics.hook_seconds
+    quantiles = ', '.join(f'p{q * 100:g} {value * 1e6:.1f} us'
+                          for q, value in zip(summary.quantiles, summary.percentiles(summary.quantiles)))
+    print(f'{summary.count} events, mean {summary.sum / summary.count * 1e6:.1f} us, {quantiles}')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,111 @@
+# MIT License
+
+# Copyright (c) 2023 ElliotCS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+    Compares per-event latency with latency mode off and on, while the "UI" churns out
+    cyclic garbage between events. Run: python benchmarks/bench_latency.py [events]
+
+    With the mode off, collections land inside event handling whenever the allocation
+    threshold trips there, and full collections walk the whole loaded config. With it on,
+    the config is frozen and collections run in the idle slot between frames instead.
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import gc
+import logging
+from time import perf_counter
+from backends import FakeBackend
+from engine import Engine
+from latency import latency
+from macros import Macros
+
+
+class Node:
+    def __init__(self) -> None:
+        self.other = self
+
+
+def churn(count: int = 300) -> None:
+    """ Garbage like a Tk redraw leaves behind: small cycles only the collector frees. """
+    for _ in range(count):
+        Node()
+
+
+def measure(events: int, enabled: bool) -> list[float]:
+    data = {
+        f'macro {i}': {'menu_keycode': 59 + i % 10, 'activation_keycode': 2 + i // 10 % 40, 'text': f'Quick chat number {i}!'}
+        for i in range(400)
+    }
+    # A big long-lived heap, like a large config plus the UI, makes full collections slow
+    ballast = [{'key': i, 'value': [i]} for i in range(300_000)]
+
+    gc.collect()
+    if enabled:
+        latency.enable(priority=False)
+    backend = FakeBackend()
+    engine = Engine(Macros(None, data=data), backend)
+
+    def play(macro) -> None:
+        with latency.playing():
+            macro.play(backend)
+
+    engine.play = play  # type: ignore
+    engine.start()
+
+    times = []
+    for i in range(events):
+        churn()
+        key = 59 + i % 10
+        start = perf_counter()
+        backend.feed(key, True)
+        backend.feed(2 + i % 40, True)
+        backend.feed(key, False)
+        backend.feed(2 + i % 40, False)
+        times.append(perf_counter() - start)
+        if i % 4 == 0:
+            engine.expire()  # the overlay's frame loop
+
+    engine.stop()
+    if enabled:
+        latency.disable()
+    del ballast
+    gc.collect()
+    return times
+
+
+def report(name: str, times: list[float]) -> None:
+    times = sorted(times)
+    pick = lambda q: times[min(len(times) - 1, int(q * len(times)))] * 1e6
+    print(f'{name:4} p50 {pick(0.5):8.1f} us   p99 {pick(0.99):8.1f} us   p99.9 {pick(0.999):8.1f} us   max {times[-1] * 1e6:8.1f} us')
+
+
+def main(events: int = 20_000) -> None:
+    logging.disable(logging.CRITICAL)
+    report('off', measure(events, False))
+    report('on', measure(events, True))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
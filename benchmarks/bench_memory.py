@@ -0,0 +1,80 @@
+# MIT License
+
+# Copyright (c) 2023 ElliotCS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+""" Measures how many bytes each macro costs, alone and once loaded. Run: python benchmarks/bench_memory.py [count] """
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import gc
+import logging
+import tracemalloc
+from typing import Callable
+from keycodes import VK_FLAG, scan_table, vk_table
+from macros import Macro, Macros
+
+# Menus need scan codes, activation keys can be any key we have a name for
+MENU_KEYS = [code for code, name in enumerate(scan_table) if name]
+KEYS = MENU_KEYS + [code | VK_FLAG for code, name in enumerate(vk_table) if name]
+
+
+def config(count: int) -> dict:
+    """ `count` macros, each on its own menu and activation key combination. """
+    combos = ((menu, key) for menu in MENU_KEYS for key in KEYS if key != menu)
+    data = {}
+    for i, (menu, key) in zip(range(count), combos):
+        data[f'macro {i}'] = {'menu_keycode': menu, 'activation_keycode': key, 'text': f'Quick chat number {i}!'}
+    if len(data) < count:
+        raise SystemExit(f'There are only {len(data)} key combinations, ask for fewer macros')
+    return data
+
+
+def main(count: int = 10_000) -> None:
+    logging.disable(logging.CRITICAL)
+    data = config(count)
+
+    tracemalloc.start()
+    records = measure(lambda: [Macro(name, entry) for name, entry in data.items()])
+    programs = measure(lambda: [macro.compile() for macro in records[0]])
+    macros = measure(lambda: Macros(None, data=data))
+    tracemalloc.stop()
+
+    # The data dict, and so the names and texts, exist before anything is measured
+    print(f'{count} macros, bytes per macro:')
+    print(f'  Macro record      {records[1] / count:6.0f}')
+    print(f'  compiled program  {programs[1] / count:6.0f}')
+    print(f'  loaded in Macros  {macros[1] / count:6.0f}  (record, program, menus, snapshot and scheduler)')
+
+
+def measure(build: Callable[[], object]) -> tuple[object, int]:
+    """ Returns what `build` made and the bytes it allocated and kept. """
+    gc.collect()
+    before = tracemalloc.take_snapshot()
+    result = build()
+    gc.collect()
+    after = tracemalloc.take_snapshot()
+    return result, sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,75 @@
+# MIT License
+
+# Copyright (c) 2023 ElliotCS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+""" Replays a synthetic key event trace as fast as possible. Run: python benchmarks/bench_replay.py [key presses] """
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import logging
+import random
+import tempfile
+from time import perf_counter
+from backends import FakeBackend
+from engine import Engine
+from keytrace import Trace, replay, write_trace
+from macros import Macros
+
+
+def main(presses: int = 1_000_000) -> None:
+    logging.disable(logging.CRITICAL)
+    data = {
+        f'macro {i}': {'menu_keycode': 2 + i // 4, 'activation_keycode': 2 + i % 4, 'text': f'Quick chat {i}'}
+        for i in range(16)
+    }
+
+    # Mostly movement keys the engine ignores, with menus and choices mixed in
+    rng = random.Random(1)
+    keys = [17, 30, 31, 32, 57, 42, 2, 3, 4, 5]
+    events = []
+    for i in range(presses):
+        time = i * 0.05
+        key = rng.choice(keys)
+        events.append((time, key, True))
+        events.append((time + 0.03, key, False))
+
+    with tempfile.TemporaryDirectory() as directory:
+        filename = os.path.join(directory, 'bench.trace')
+        write_trace(filename, events)
+        trace = Trace(filename)
+
+        engine = Engine(Macros(None, data=data), FakeBackend())
+        played: list = []
+        engine.play = played.append  # type: ignore
+        engine.start()
+
+        start = perf_counter()
+        count = replay(trace, engine)
+        elapsed = perf_counter() - start
+        trace.close()
+
+    print(f'{count} events in {elapsed:.3f} s, {count / elapsed / 1e6:.2f} million events per second, {len(played)} macros triggered')
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
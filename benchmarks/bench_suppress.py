@@ -0,0 +1,152 @@
+# MIT License
+
+# Copyright (c) 2023 ElliotCS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+    Checks key suppression decisions: that the right keys are swallowed, and that the
+    worst-case time to decide stays bounded however large the config is.
+    Exits non-zero on failure. Run: python benchmarks/bench_suppress.py [budget in us]
+"""
+
+import os
+import sys
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+import logging
+from threading import Event
+from time import perf_counter_ns, sleep
+from backends import FakeBackend
+from core import core
+from engine import Engine
+from keycodes import scan_keynames
+from macros import Macros
+
+MENUS = [59, 60, 61, 62, 63, 64, 65, 66, 67, 68]
+SOLO = 87
+KEYS = [code for code in sorted(scan_keynames) if code not in MENUS and code != SOLO]
+
+
+def config(per_menu: int) -> dict:
+    data = {
+        f'macro {menu} {key}': {'menu_keycode': menu, 'activation_keycode': key, 'text': f'Chat {menu}.{key}'}
+        for menu in MENUS
+        for key in KEYS[:per_menu]
+    }
+    data['solo'] = {'activation_keycode': SOLO, 'text': 'Solo'}
+    return data
+
+
+def wait_for(condition) -> None:
+    for _ in range(1000):
+        if condition():
+            return
+        sleep(0.001)
+    raise AssertionError('the engine thread never caught up')
+
+
+def check_behaviour() -> None:
+    backend = FakeBackend()
+    engine = Engine(Macros(None, data=config(4)), backend, suppress=True)
+    played: list = []
+    engine.play = played.append  # type: ignore
+    engine.start()
+
+    assert backend.feed(30, True) and backend.feed(30, False), 'unused keys must pass'
+    assert backend.feed(2, True) and backend.feed(2, False), 'activation keys pass while no menu is open'
+    assert not backend.feed(87, True) and not backend.feed(87, False), 'solo keys are swallowed'
+
+    assert not backend.feed(59, True), 'the menu key is swallowed'
+    assert not backend.feed(59, True), 'and so are its repeats'
+    assert not backend.feed(59, False), 'and its release'
+    wait_for(lambda: engine.current_menu == 59)
+    assert backend.feed(60, True) and backend.feed(60, False), 'other menu keys pass while a menu is open'
+    assert not backend.feed(3, True), 'activation keys are swallowed while their menu is open'
+    wait_for(lambda: engine.current_menu is None)
+    assert not backend.feed(3, False), 'the release of a swallowed key is swallowed even after the menu closed'
+
+    # The hook follows the menu itself, so a busy engine loop can't change what the game sees
+    wait_for(lambda: len(played) == 2)
+    played.clear()
+    busy = Event()
+    core.call(busy.wait, 1.0)
+    assert not backend.feed(60, True) and not backend.feed(60, False), 'a menu key is swallowed while the loop is busy'
+    assert not backend.feed(2, True) and not backend.feed(2, False), 'and so is its activation key right after'
+    assert backend.feed(3, True) and backend.feed(3, False), 'which closed the menu, so the next activation key passes'
+    busy.set()
+    wait_for(lambda: engine.current_menu is None and played)
+    sleep(0.05)
+    assert [macro.name for macro in played] == ['macro 60 2'], 'only the swallowed activation key plays'
+
+    engine.pause()
+    assert backend.feed(59, True) and backend.feed(59, False), 'nothing is swallowed while paused'
+    engine.resume()
+    engine.stop()
+    print('suppression behaviour OK')
+
+
+def worst_decision(per_menu: int, rounds: int = 50) -> tuple[float, float, float]:
+    """
+        Returns (worst per-input time, p99.9 of single calls, worst single call) in
+        microseconds across every state and key. Each input's time is its best over the
+        rounds, which takes out preemption and other noise the decision itself isn't
+        responsible for. The p99.9 keeps an occasional slow path from hiding behind that.
+    """
+    engine = Engine(Macros(None, data=config(per_menu)), FakeBackend(), suppress=True)
+    decide = engine.decide
+    states = [None] + MENUS
+    best: dict[tuple, int] = {}
+    calls: list[int] = []
+    for _ in range(rounds):
+        for state in states:
+            table = engine.idle_table if state is None else engine.menu_tables[state]
+            engine.menu_deadline = float('inf')
+            for code in range(300):
+                engine.swallowed[code % 256] = 0
+                for down in (True, False):
+                    engine.suppress_table = table  # a decision may open or close the menu
+                    start = perf_counter_ns()
+                    decide(code, down)
+                    elapsed = perf_counter_ns() - start
+                    key = (state, code, down)
+                    best[key] = min(best.get(key, elapsed), elapsed)
+                    calls.append(elapsed)
+    calls.sort()
+    return max(best.values()) / 1000, calls[int(len(calls) * 0.999)] / 1000, calls[-1] / 1000
+
+
+def main(budget: float = 20.0) -> None:
+    logging.disable(logging.CRITICAL)
+    check_behaviour()
+
+    failed = False
+    for per_menu in (4, 40, len(KEYS)):
+        worst, p999, worst_call = worst_decision(per_menu)
+        print(f'{len(MENUS) * per_menu + 1:5} macros: worst decision {worst:.2f} us, p99.9 of calls {p999:.2f} us'
+              f' (slowest single call {worst_call:.2f} us)')
+        failed |= worst > budget or p999 > budget
+    if failed:
+        print(f'FAIL a decision, or the p99.9 of calls, took longer than {budget} us')
+        sys.exit(1)
+    print(f'OK every decision and the p99.9 of calls within {budget} us')
+
+
+if __name__ == '__main__':
+    main(*map(float, sys.argv[1:]))
@@ -0,0 +1,223 @@
+# MIT License
+
+# Copyright (c) 2023 ElliotCS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+    Soak test for the Tk side: cycles menus, pages, add/delete and mode switches thousands
+    of times and fails if memory, Tcl objects or hook registrations keep growing, or if
+    switching between the editor and the overlay gets slow.
+
+    Needs a display, e.g.  xvfb-run python benchmarks/soak.py --cycles 5000
+"""
+
+import os
+import sys
+import tempfile
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+# main.py keeps its logs, configs and profile store under %APPDATA%, keep the soak out of the real one
+os.environ['APPDATA'] = tempfile.mkdtemp(prefix='emacros-soak-')
+
+import argparse
+import gc
+import logging
+import tracemalloc
+from time import perf_counter
+from tkinter import Tk
+from backends import FakeBackend
+from macros import Macros
+import main
+
+
+def rss() -> int:
+    """ Resident memory in bytes, or 0 where we can't tell. """
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except ImportError:
+        return 0
+
+
+def widgets(widget) -> int:
+    return 1 + sum(widgets(child) for child in widget.winfo_children())
+
+
+def tcl_objects(app: Tk) -> dict[str, int]:
+    """ Counts of the Tcl-side things a leak would pile up in the app's interpreter. """
+    call = app.tk.call
+    split = app.tk.splitlist
+    return {
+        'commands': len(split(call('info', 'commands'))),
+        'fonts': len(split(call('font', 'names'))),
+        'images': len(split(call('image', 'names'))),
+        'variables': len(split(call('info', 'globals'))),
+        'timers': len(split(call('after', 'info'))),
+        'widgets': widgets(app),
+    }
+
+
+def live_roots() -> int:
+    return sum(1 for obj in gc.get_objects() if isinstance(obj, Tk))
+
+
+class Soak:
+
+    def __init__(self, menus: int = 4, per_menu: int = 6) -> None:
+        data = {
+            f'macro {menu} {key}': {
+                'menu_keycode': 59 + menu,
+                'activation_keycode': 2 + key,
+                'text': f'Quick chat {menu}.{key}',
+            }
+            for menu in range(menus)
+            for key in range(per_menu)
+        }
+        self.macros = Macros(None, data=data)
+        self.menu_keys = [59 + menu for menu in range(menus)]
+        self.backend = FakeBackend()
+        self.root = main.App(self.macros, backend=self.backend)
+        self.root.engine.play = lambda macro: None  # nothing to type into
+        self.app = self.root.window
+        self.samples: dict[str, list[dict[str, int]]] = {'overlay': [], 'settings': []}
+        self.switch_times: list[float] = []
+
+    def switch(self, mode: str) -> None:
+        start = perf_counter()
+        if mode == 'overlay':
+            self.root.show_overlay()
+        else:
+            self.root.show_settings()
+        self.app = self.root.window
+        self.app.update()
+        self.switch_times.append(perf_counter() - start)
+
+    def overlay_cycle(self, i: int) -> None:
+        app = self.app
+        menu = self.menu_keys[i % len(self.menu_keys)]
+        app.text_offset = i % 5  # a few font sizes
+        self.backend.tap(menu)
+        app.apply_menu_events()
+        app.update()
+        self.backend.tap(2 + i % 6)  # choosing a macro closes the menu
+        # Several toggles within one frame must still be a single redraw
+        self.backend.tap(menu)
+        app.engine.close_menu()
+        app.apply_menu_events()
+        app.update()
+
+    def settings_cycle(self, i: int) -> None:
+        app = self.app
+        app.next_page()
+        app.previous_page()
+        app.add_macro()
+        app.delete_macro(app.macros.get_macro(-1, -1))
+        app.query.set(f'chat {i % 4}')
+        app.query.set('')
+        app.update()
+
+    def sample(self, mode: str) -> None:
+        gc.collect()
+        current, _ = tracemalloc.get_traced_memory()
+        sample = {'python': current, 'rss': rss(), 'roots': live_roots(), 'hooks': len(self.backend.callbacks)}
+        sample.update(tcl_objects(self.root))
+        self.samples[mode].append(sample)
+
+    def run(self, cycles: int, switch_every: int) -> None:
+        mode = 'overlay'
+        self.switch(mode)
+        for i in range(cycles):
+            if i and i % switch_every == 0:
+                self.sample(mode)
+                mode = 'settings' if mode == 'overlay' else 'overlay'
+                self.switch(mode)
+            if mode == 'overlay':
+                self.overlay_cycle(i)
+            else:
+                self.settings_cycle(i)
+        self.sample(mode)
+        self.root.destroy()
+
+
+def check(samples: list[dict[str, int]], mode: str, args) -> list[str]:
+    """ Compares the last sample against the one after warmup. """
+    if len(samples) < 3:
+        return [f'{mode}: not enough samples, run more cycles']
+
+    # The first pass through each mode fills caches, so start from the second
+    first, last = samples[1], samples[-1]
+    limits = {
+        'python': args.max_python_kb * 1024,
+        'rss': args.max_rss_mb * 1024 * 1024,
+        'commands': args.max_tcl,
+        'fonts': args.max_tcl,
+        'images': args.max_tcl,
+        'variables': args.max_tcl,
+        'timers': 1,
+        'widgets': args.max_tcl,
+    }
+    failures = []
+    for key, limit in limits.items():
+        growth = last[key] - first[key]
+        print(f'  {mode:8} {key:10} {first[key]:>12} -> {last[key]:>12}  ({growth:+})')
+        if growth > limit:
+            failures.append(f'{mode}: {key} grew by {growth}, more than {limit}')
+    if last['roots'] > 1:
+        failures.append(f'{mode}: {last["roots"]} Tk roots alive, there should only ever be one')
+    if last['hooks'] != 1:
+        failures.append(f'{mode}: {last["hooks"]} hook registrations, the one hook should stay installed')
+    return failures
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--cycles', type=int, default=5000)
+    parser.add_argument('--switch-every', type=int, default=250, help='cycles between overlay/settings switches')
+    parser.add_argument('--max-python-kb', type=int, default=256, help='allowed growth of traced Python memory')
+    parser.add_argument('--max-rss-mb', type=int, default=8, help='allowed growth of resident memory')
+    parser.add_argument('--max-tcl', type=int, default=0, help='allowed growth of each Tcl object count')
+    parser.add_argument('--max-switch-ms', type=float, default=50, help='allowed median overlay/settings switch time')
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    tracemalloc.start()
+    soak = Soak()
+    soak.run(args.cycles, args.switch_every)
+
+    failures = []
+    for mode, samples in soak.samples.items():
+        failures += check(samples, mode, args)
+
+    times = sorted(soak.switch_times)
+    median = times[len(times) // 2] * 1000
+    print(f'  switches: {len(times)}, median {median:.1f} ms, worst {times[-1] * 1000:.1f} ms')
+    if median > args.max_switch_ms:
+        failures.append(f'median switch took {median:.1f} ms, more than {args.max_switch_ms} ms')
+
+    for failure in failures:
+        print(f'FAIL {failure}')
+    if failures:
+        sys.exit(1)
+    print(f'OK after {args.cycles} cycles')
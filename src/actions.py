@@ -0,0 +1,288 @@
+# MIT License
+
+# Copyright (c) 2023 ElliotCS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+    A tiny language for multi-step macros. Each step is one line:
+
+        say <text>          open chat, type the text and press Enter
+        type <text>         type the text without opening chat
+        tap <key>           press and release a key
+        down <key>          press a key
+        up <key>            release a key
+        hold <key> <ms>     hold a key for a number of milliseconds
+        wait <ms>           pause
+        repeat <n>          repeat the steps up to the matching `end`
+        end
+
+    Keys are key names (`Enter`, `Np5`, `F1`) or scan codes. Steps are compiled at
+    load time into a flat array of (opcode, argument) pairs that `run`, or `run_async`
+    on the engine loop, executes.
+"""
+
+from array import array
+from typing import Awaitable, Callable, Generator, Iterable
+from keycodes import SHIFT_FLAG, SHIFT_SCAN_CODE, ENTER_SCAN_CODE, VK_FLAG, char_code, keyname_to_code
+
+DOWN = 0
+UP = 1
+WAIT = 2  # argument is in microseconds
+REPEAT = 3
+NEXT = 4  # argument is the instruction index to jump back to
+WRITE = 5  # argument indexes Program.texts, characters the layout has no plain or shifted key for
+
+CHAT_OPEN_DELAY = 50_000
+KEY_DELAY = 100
+
+
+class ActionError(ValueError):
+
+    def __init__(self, errors: list[str]) -> None:
+        super().__init__('\n'.join(errors))
+        self.errors = errors
+
+
+class Program:
+    """ Compiled actions: `code` holds opcode/argument pairs, `texts` the characters WRITE types as unicode. """
+
+    __slots__ = ('code', 'texts')
+
+    def __init__(self, code: array, texts: tuple[str, ...]) -> None:
+        self.code = code
+        self.texts = texts
+
+    def __len__(self) -> int:
+        return len(self.code) // 2
+
+
+class Compiler:
+
+    def __init__(self, chat_opener_keycode: int) -> None:
+        self.chat_opener_keycode = chat_opener_keycode
+        self.code = array('q')
+        self.texts: list[str] = []
+        self.loops: list[tuple[int, int]] = []  # (jump target, line number)
+        self.errors: list[str] = []
+
+    def emit(self, op: int, arg: int = 0) -> None:
+        self.code.append(op)
+        self.code.append(arg)
+
+    def key(self, arg: str, number: int) -> int:
+        arg = arg.strip()
+        code = keyname_to_code.get(arg.lower())
+        if code is None and arg.isdigit():
+            code = int(arg)
+        if code is None or code & VK_FLAG:
+            self.errors.append(f'step {number}: unknown key {arg!r}')
+            return -1
+        return code
+
+    def number(self, arg: str, number: int, what: str) -> int:
+        try:
+            value = int(arg)
+        except ValueError:
+            value = -1
+        if value < 0:
+            self.errors.append(f'step {number}: {what} must be a whole number, not {arg!r}')
+            return 0
+        return value
+
+    def type_text(self, text: str) -> None:
+        for char in text:
+            code = char_code(char)
+            if not code:
+                if char not in self.texts:
+                    self.texts.append(char)
+                self.emit(WRITE, self.texts.index(char))
+            elif code & SHIFT_FLAG:
+                code ^= SHIFT_FLAG
+                self.emit(DOWN, SHIFT_SCAN_CODE)
+                self.emit(DOWN, code)
+                self.emit(UP, code)
+                self.emit(UP, SHIFT_SCAN_CODE)
+            else:
+                self.emit(DOWN, code)
+                self.emit(UP, code)
+            self.emit(WAIT, KEY_DELAY)
+
+    def say(self, text: str) -> None:
+        if self.chat_opener_keycode > 0:
+            self.emit(DOWN, self.chat_opener_keycode)
+            self.emit(UP, self.chat_opener_keycode)
+            self.emit(WAIT, CHAT_OPEN_DELAY)
+        self.type_text(text)
+        self.emit(DOWN, ENTER_SCAN_CODE)
+        self.emit(UP, ENTER_SCAN_CODE)
+
+    def step(self, line: str, number: int) -> None:
+        # Text arguments keep their spaces, everything else is trimmed
+        command, _, arg = line.lstrip().partition(' ')
+        command = command.lower()
+
+        if command == 'say':
+            self.say(arg)
+        elif command == 'type':
+            self.type_text(arg)
+        elif command == 'tap':
+            code = self.key(arg, number)
+            self.emit(DOWN, code)
+            self.emit(UP, code)
+        elif command == 'down':
+            self.emit(DOWN, self.key(arg, number))
+        elif command == 'up':
+            self.emit(UP, self.key(arg, number))
+        elif command == 'hold':
+            name, _, ms = arg.strip().rpartition(' ')
+            code = self.key(name, number)
+            self.emit(DOWN, code)
+            self.emit(WAIT, self.number(ms, number, 'hold time') * 1000)
+            self.emit(UP, code)
+        elif command == 'wait':
+            self.emit(WAIT, self.number(arg, number, 'wait time') * 1000)
+        elif command == 'repeat':
+            self.emit(REPEAT, self.number(arg, number, 'repeat count'))
+            self.loops.append((len(self.code), number))
+        elif command == 'end':
+            if not self.loops:
+                self.errors.append(f'step {number}: `end` without `repeat`')
+                return
+            target, _ = self.loops.pop()
+            self.emit(NEXT, target)
+        else:
+            self.errors.append(f'step {number}: unknown action {command!r}')
+
+
+def compile_actions(steps: Iterable[str], chat_opener_keycode: int = -1) -> Program:
+    """ Compiles action steps, raising an ActionError listing every bad step. """
+    compiler = Compiler(chat_opener_keycode)
+    for number, line in enumerate(steps, 1):
+        if type(line) is not str:
+            compiler.errors.append(f'step {number}: expected a string, not {line!r}')
+            continue
+        if line.strip():
+            compiler.step(line, number)
+
+    for _, number in compiler.loops:
+        compiler.errors.append(f'step {number}: `repeat` without `end`')
+    if compiler.errors:
+        raise ActionError(compiler.errors)
+
+    return Program(compiler.code, tuple(compiler.texts))
+
+
+def compile_say(text: str, chat_opener_keycode: int = -1) -> Program:
+    """ The program for a plain text macro. """
+    compiler = Compiler(chat_opener_keycode)
+    compiler.say(text)
+    return Program(compiler.code, tuple(compiler.texts))
+
+
+def execute(program: Program, press: Callable, release: Callable, write: Callable[[str], None]) -> Generator[float, None, int]:
+    """ Executes a compiled program, yielding the seconds to wait at each pause. Returns how many key events it sent. """
+    code = program.code
+    texts = program.texts
+    counters = []
+    sent = 0
+    pc = 0
+    end = len(code)
+    while pc < end:
+        op = code[pc]
+        arg = code[pc + 1]
+        pc += 2
+        if op == DOWN:
+            press(arg)
+            sent += 1
+        elif op == UP:
+            release(arg)
+            sent += 1
+        elif op == WAIT:
+            yield arg / 1_000_000
+        elif op == REPEAT:
+            if arg:
+                counters.append(arg)
+            else:
+                pc = skip_loop(code, pc)
+        elif op == NEXT:
+            counters[-1] -= 1
+            if counters[-1]:
+                pc = arg
+            else:
+                counters.pop()
+        elif op == WRITE:
+            write(texts[arg])
+            sent += 2
+    return sent
+
+
+def run(program: Program, press: Callable, release: Callable, write: Callable[[str], None],
+        sleep: Callable[[float], None]) -> int:
+    """ Executes a compiled program, blocking through its pauses. Returns how many key events it sent. """
+    steps = execute(program, press, release, write)
+    try:
+        while True:
+            sleep(next(steps))
+    except StopIteration as done:
+        return done.value
+
+
+async def run_async(program: Program, press: Callable, release: Callable, write: Callable[[str], None],
+                    wait: Callable[[float], Awaitable]) -> int:
+    """
+        Executes a compiled program as a coroutine, awaiting `wait` at each pause. If it is
+        cancelled, the keys it was holding down are released.
+    """
+    held: dict = {}
+
+    def tracked_press(key) -> None:
+        press(key)
+        held[key] = True
+
+    def tracked_release(key) -> None:
+        release(key)
+        held.pop(key, None)
+
+    steps = execute(program, tracked_press, tracked_release, write)
+    try:
+        while True:
+            await wait(next(steps))
+    except StopIteration as done:
+        return done.value
+    except BaseException:
+        for key in held:
+            release(key)
+        raise
+
+
+def skip_loop(code: array, pc: int) -> int:
+    """ Returns the index just past the NEXT that closes the loop whose body starts at `pc`. """
+    depth = 0
+    while pc < len(code):
+        op = code[pc]
+        pc += 2
+        if op == REPEAT:
+            depth += 1
+        elif op == NEXT:
+            if not depth:
+                return pc
+            depth -= 1
+    return pc
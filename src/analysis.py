@@ -0,0 +1,71 @@
+# MIT License
+
+# Copyright (c) 2023 ElliotCS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from __future__ import annotations
+from typing import Iterable, TYPE_CHECKING
+if TYPE_CHECKING:
+    from macros import Macro
+from keycodes import get_keyname
+
+
+def describe(menu_keycode: int, activation_keycode: int) -> str:
+    if menu_keycode == -1:
+        return get_keyname(activation_keycode)
+    return f'{get_keyname(menu_keycode)} > {get_keyname(activation_keycode)}'
+
+
+def find_conflicts(macros: Iterable[tuple[Macro, str]]) -> list[str]:
+    """
+        Checks a whole config in one pass over (macro, location) pairs, returning a message
+        for every duplicate name, key combination used twice, and solo key that a menu
+        key shadows. Unknown key codes are reported by Macro.check_keycodes.
+    """
+    errors: list[str] = []
+    names: dict[str, str] = {}
+    combos: dict[tuple[int, int], tuple[Macro, str]] = {}
+    menus: dict[int, tuple[Macro, str]] = {}  # first macro seen in each menu
+    solos: dict[int, list[tuple[Macro, str]]] = {}
+
+    for macro, where in macros:
+        if macro.name in names:
+            errors.append(f'{where}: duplicate macro name {macro.name!r}, first used at {names[macro.name]}')
+        else:
+            names[macro.name] = where
+
+        menu, key = macro.menu_keycode, macro.activation_keycode
+        other = combos.setdefault((menu, key), (macro, where))
+        if other[0] is not macro:
+            errors.append(f'{where}: {describe(menu, key)} is already used by macro {other[0].name!r} at {other[1]}')
+            continue
+
+        if menu == -1:
+            solos.setdefault(key, []).append((macro, where))
+            if key in menus:
+                owner, owner_where = menus[key]
+                errors.append(f'{where}: solo key {get_keyname(key)} never fires, it opens the menu of macro {owner.name!r} at {owner_where}')
+        elif menu not in menus:
+            menus[menu] = (macro, where)
+            for solo, solo_where in solos.get(menu, ()):
+                errors.append(f'{solo_where}: solo key {get_keyname(menu)} never fires, it opens the menu of macro {macro.name!r} at {where}')
+
+    return errors
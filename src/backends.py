@@ -0,0 +1,131 @@
+# MIT License
+
+# Copyright (c) 2023 ElliotCS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from typing import Callable, Optional, Union
+from time import perf_counter, sleep
+import asyncio
+import keyboard
+
+Key = Union[int, str]
+Callback = Callable[[int, bool], None]
+
+COARSE_WAIT = 0.016  # asyncio timers can fire up to a timer tick late, about 16 ms on Windows
+
+
+class KeyboardBackend:
+    """
+        The real keyboard, through the keyboard library. Hook callbacks get (scan_code, is_down).
+        `watched` is a scan code bitmap a backend may use to drop events early, this one
+        delivers everything. With `suppress`, the callback runs inside the OS hook and
+        returns whether the event should go on to other programs.
+    """
+
+    def hook(self, callback: Callback, watched: Optional[bytearray] = None, suppress: bool = False) -> Callable[[], None]:
+        return keyboard.hook(lambda event: callback(event.scan_code, event.event_type == 'down'), suppress=suppress)
+
+    def press(self, key: Key) -> None:
+        keyboard.press(key)
+
+    def release(self, key: Key) -> None:
+        keyboard.release(key)
+
+    def write(self, text: str) -> None:
+        """ Types characters no key on the layout makes, as unicode where the OS allows it. """
+        keyboard.write(text)
+
+    def sleep(self, seconds: float) -> None:
+        sleep(seconds)
+
+    async def wait(self, seconds: float) -> None:
+        """ Pauses playback on the engine loop. Long pauses free the loop, the last stretch is slept precisely. """
+        deadline = perf_counter() + seconds
+        if seconds > COARSE_WAIT:
+            await asyncio.sleep(seconds - COARSE_WAIT)
+        else:
+            await asyncio.sleep(0)  # let queued key events in between keystrokes
+        remaining = deadline - perf_counter()
+        if remaining > 0:
+            sleep(remaining)
+
+    def close(self) -> None:
+        """ Releases what the backend holds once the engine is done with it. The keyboard library needs nothing. """
+
+
+class FakeBackend:
+    """
+        No keyboard at all: events are fed in with `feed`, and key presses macros send are
+        only counted (and logged if `record` is set). Playback doesn't sleep. Events a
+        suppressing hook rejects are counted in `suppressed`, and not passed on.
+    """
+
+    def __init__(self, record: bool = False) -> None:
+        self.callbacks: list[Callback] = []
+        self.blockers: list[Callable[[int, bool], bool]] = []
+        self.suppressed = 0
+        self.record = record
+        self.sent: list[tuple[bool, Key]] = []
+        self.sent_count = 0
+
+    def hook(self, callback: Callback, watched: Optional[bytearray] = None, suppress: bool = False) -> Callable[[], None]:
+        hooks = self.blockers if suppress else self.callbacks
+        hooks.append(callback)  # type: ignore
+        return lambda: hooks.remove(callback) if callback in hooks else None  # type: ignore
+
+    def feed(self, scan_code: int, down: bool = True) -> bool:
+        """ Sends an event through the hooks, returning whether it would reach the game. """
+        # Like the keyboard library, a suppressed event never reaches the other hooks
+        if not all([blocker(scan_code, down) for blocker in self.blockers]):
+            self.suppressed += 1
+            return False
+        for callback in self.callbacks:
+            callback(scan_code, down)
+        return True
+
+    def tap(self, scan_code: int) -> None:
+        self.feed(scan_code, True)
+        self.feed(scan_code, False)
+
+    def press(self, key: Key) -> None:
+        self.sent_count += 1
+        if self.record:
+            self.sent.append((True, key))
+
+    def release(self, key: Key) -> None:
+        self.sent_count += 1
+        if self.record:
+            self.sent.append((False, key))
+
+    def write(self, text: str) -> None:
+        self.sent_count += 2
+        if self.record:
+            self.sent.append((True, text))
+            self.sent.append((False, text))
+
+    def sleep(self, seconds: float) -> None:
+        pass
+
+    async def wait(self, seconds: float) -> None:
+        await asyncio.sleep(0)
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,156 @@
+# MIT License
+
+# Copyright (c) 2023 ElliotCS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from __future__ import annotations
+from typing import Callable, Optional
+from concurrent.futures import TimeoutError as FutureTimeout
+from core import core
+from engine import Engine
+import asyncio
+import hmac
+import json
+import logging
+import os
+import secrets
+
+
+class ControlError(Exception):
+    pass
+
+
+def load_token(filename: str) -> str:
+    """ Reads the control token from filename, creating it (readable only by this user) if needed. """
+    try:
+        with open(filename, encoding='utf-8') as f:
+            token = f.read().strip()
+        if token:
+            return token
+    except FileNotFoundError:
+        pass
+    token = secrets.token_hex(16)
+    fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(token)
+    return token
+
+
+def execute(engine: Optional[Engine], request: dict) -> dict:
+    """
+        Runs one control command and returns the JSON-able reply. Commands
+        (each also carries the "token", see handle):
+
+            {"cmd": "trigger", "name": "What a save!"}
+            {"cmd": "trigger", "menu": "F1", "key": "2"}       (omit "menu" for solo macros)
+            {"cmd": "key", "code": 59, "down": true}           (feeds a key event through dispatch)
+            {"cmd": "load", "path": "C:/.../quickchats.yml"}
+            {"cmd": "reload"}
+            {"cmd": "pause"} / {"cmd": "resume"}
+            {"cmd": "state"}
+    """
+    cmd = request.get('cmd')
+    if engine is None:
+        raise ControlError('The overlay is not running.')
+
+    if cmd == 'trigger':
+        macro = engine.trigger(request.get('name'), request.get('menu'), request.get('key'))
+        return {'macro': macro.name}
+    if cmd == 'key':
+        engine.inject(int(request['code']), bool(request.get('down', True)))
+        return {}
+    if cmd == 'load':
+        engine.load(request['path'])
+        return engine.state()
+    if cmd == 'reload':
+        engine.reload()
+        return engine.state()
+    if cmd == 'pause':
+        engine.pause()
+        return {}
+    if cmd == 'resume':
+        engine.resume()
+        return {}
+    if cmd == 'state':
+        return engine.state()
+    raise ControlError(f'Unknown command {cmd!r}')
+
+
+async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                 get_engine: Callable[[], Optional[Engine]], token: str) -> None:
+    """
+        One JSON request per line in, one JSON reply per line out. Every
+        request carries the token, {"token": "...", "cmd": ...}; a connection
+        that opens with anything else (not JSON, or a wrong token) is dropped
+        without a reply, so other programs and web pages can't drive it.
+        Runs on the engine loop; loading a file goes to a worker thread so keys keep flowing.
+    """
+    first = True
+    try:
+        while line := await reader.readline():
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+            except ValueError:
+                if first:
+                    return
+                request = None
+            if first and not authorized(request, token):
+                return
+            first = False
+            try:
+                if not isinstance(request, dict):
+                    raise ControlError('Requests must be JSON objects.')
+                if not authorized(request, token):
+                    raise ControlError('Wrong or missing token.')
+                if request.get('cmd') in ('load', 'reload'):
+                    result = await asyncio.get_running_loop().run_in_executor(None, execute, get_engine(), request)
+                else:
+                    result = execute(get_engine(), request)
+                reply = {'ok': True} | result
+            except Exception as e:
+                reply = {'ok': False, 'error': f'{type(e).__name__}: {e}'}
+            writer.write(json.dumps(reply).encode('utf-8') + b'\n')
+            await writer.drain()
+    except (ConnectionError, asyncio.LimitOverrunError, ValueError):
+        pass
+    finally:
+        writer.close()
+
+
+def authorized(request: object, token: str) -> bool:
+    given = request.get('token') if isinstance(request, dict) else None
+    return isinstance(given, str) and hmac.compare_digest(given, token)
+
+
+def serve(port: int, get_engine: Callable[[], Optional[Engine]], token: str,
+          host: str = '127.0.0.1') -> Optional[asyncio.AbstractServer]:
+    """ Listens for control commands on host:port from the engine loop. """
+    async def start() -> asyncio.AbstractServer:
+        return await asyncio.start_server(lambda r, w: handle(r, w, get_engine, token), host, port)
+    try:
+        server = core.spawn(start()).result(5.0)
+    except (OSError, FutureTimeout):
+        logging.exception(f'Could not listen for control commands on {host}:{port}')
+        return None
+    logging.log(logging.INFO, f'Listening for control commands on {host}:{port}')
+    return server
@@ -0,0 +1,98 @@
+# MIT License
+
+# Copyright (c) 2023 ElliotCS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+
+"""
+    The engine's event loop. One asyncio loop on its own thread runs what used to need a
+    thread or a polling timer each: suppressed key events handed over by the hook, menu
+    timeouts and macro playback. Other threads hand it work with `call`, `call_later` and
+    `spawn`, which are all safe to use from anywhere.
+"""
+
+from __future__ import annotations
+from typing import Any, Callable, Coroutine, Optional
+from concurrent.futures import Future
+from threading import Lock, Thread, current_thread, get_ident
+import asyncio
+import logging
+from latency import latency
+
+
+class Core:
+
+    def __init__(self) -> None:
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.thread: Optional[Thread] = None
+        self.thread_id: Optional[int] = None
+        self.lock = Lock()
+
+    def start(self) -> asyncio.AbstractEventLoop:
+        """ Starts the loop thread if it isn't running yet. """
+        with self.lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self.thread = Thread(target=self.run, args=(self.loop,), name='Engine', daemon=True)
+                self.thread.start()
+            return self.loop
+
+    def run(self, loop: asyncio.AbstractEventLoop) -> None:
+        self.thread_id = get_ident()
+        latency.tune_thread()
+        asyncio.set_event_loop(loop)
+        logging.log(logging.INFO, 'Engine loop started')
+        try:
+            loop.run_forever()
+        finally:
+            self.thread_id = None
+            loop.close()
+            logging.log(logging.INFO, 'Engine loop stopped')
+
+    def in_loop(self) -> bool:
+        return self.thread_id == get_ident()
+
+    def call(self, callback: Callable[..., Any], *args) -> None:
+        """ Runs `callback(*args)` on the loop, in the order calls were made. """
+        (self.loop or self.start()).call_soon_threadsafe(callback, *args)
+
+    def call_later(self, delay: float, callback: Callable[..., Any], *args) -> None:
+        loop = self.loop or self.start()
+        if self.in_loop():
+            loop.call_later(delay, callback, *args)
+        else:
+            loop.call_soon_threadsafe(loop.call_later, delay, callback, *args)
+
+    def spawn(self, coroutine: Coroutine) -> Future:
+        """ Runs a coroutine on the loop. The returned future can cancel it from any thread. """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop or self.start())
+
+    def stop(self) -> None:
+        with self.lock:
+            loop, thread = self.loop, self.thread
+            self.loop = self.thread = None
+        if loop is not None and thread is not None:
+            loop.call_soon_threadsafe(loop.stop)
+            if thread is not current_thread():
+                thread.join(1.0)
+
+
+core = Core()
@@ -0,0 +1,382 @@
+# MIT License
+
+# Copyright (c) 2023 ElliotCS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from __future__ import annotations
+from typing import Callable, Optional
+from macros import Macros, Macro
+from store import ProfileStore, profile_name
+from keycodes import get_keyname, keyname_to_code, scan_bitmap
+from collections import deque
+from threading import RLock
+from time import monotonic, perf_counter
+import logging
+from core import core
+from latency import latency
+import metrics
+
+
+class Engine:
+    """
+        Turns key events into menus and macro playback, with no Tk involved.
+
+        Menu changes are appended to `menu_events` (the menu's keycode when one opens, None
+        when it closes) for the UI thread to drain, so the hook thread never waits on Tk.
+
+        With `suppress`, keys EMacros consumes never reach the game: menu, solo and profile
+        keys while no menu is open, and a menu's activation keys while it is. That decision
+        is made inside the OS hook from a bitmap precomputed for each state, which the hook
+        switches itself as menus open and close. The event is handled on the engine loop
+        (see core.py), and a key the game saw never triggers anything there.
+
+        Once started, an open menu closes itself on a loop timer. Until then, e.g. while
+        replaying a trace, whoever drives the engine calls `expire`.
+    """
+
+    menu_close_delay: float = 2.0
+
+    def __init__(self, macros: Optional[Macros], backend, store: Optional[ProfileStore] = None, profile: Optional[str] = None,
+                 suppress: bool = False) -> None:
+        self.backend = backend
+        self.suppress = suppress
+        self.store = store
+        self.macros = macros
+        self.profile = profile
+        self.lock = RLock()  # guards the open menu and swapping macros, key lookups don't take it
+        self.menu_events: deque[Optional[int]] = deque(maxlen=256)
+
+        self.unique_scan_codes: set[int] = set()
+        self.watched = bytearray(256)
+        self.down_keys: set[int] = set()
+        self.current_menu: Optional[int] = None
+        self.menu_opened: Optional[float] = None
+        self.menu_timer_pending = False
+        self.clock: Callable[[], float] = monotonic  # replays swap in the trace's clock
+        self.paused = False
+        self.unhook: Optional[Callable[[], None]] = None
+
+        # Which keys to swallow: one bitmap for no menu open, one per menu, and the one in use
+        self.idle_table = bytearray(256)
+        self.menu_tables: dict[int, bytearray] = {}
+        self.pass_all = bytearray(256)
+        self.suppress_table = self.idle_table
+        self.swallowed = bytearray(256)  # keys whose down we ate, so we eat their repeats and up too
+        self.menu_deadline = 0.0  # when the menu the hook has open times out
+
+        self.set_macros(macros, profile)
+
+    def start(self) -> None:
+        if self.unhook is not None:
+            return
+        core.start()
+        if self.suppress:
+            self.unhook = self.backend.hook(self.filter, self.watched, suppress=True)
+        else:
+            # Backends that can filter by scan code before calling us get the bitmap
+            self.unhook = self.backend.hook(self.keyloop, self.watched)
+
+    def stop(self) -> None:
+        if self.unhook is not None:
+            self.unhook()
+            self.unhook = None
+        if self.macros:
+            self.macros.scheduler.cancel()
+            logging.log(logging.INFO, f'Chat scheduler stats: {self.macros.scheduler.stats()}')
+        self.backend.close()  # e.g. the evdev reader thread and its open devices
+
+    def set_macros(self, macros: Optional[Macros], profile: Optional[str] = None) -> None:
+        """ Swaps in other macros. They were armed when they loaded or were stored, so this compiles nothing. """
+        with self.lock:
+            if self.macros and self.macros is not macros:
+                self.macros.scheduler.clear()
+            if macros:
+                macros.scheduler.backend = self.backend
+            self.close_menu()
+            self.macros = macros
+            self.profile = profile
+            self.refresh_scan_codes()
+        latency.freeze_soon()  # not here: a profile hotkey switches on the hook thread
+
+    def refresh_scan_codes(self) -> None:
+        scan_codes = self.macros.snapshot.scan_codes() if self.macros else set()
+        if self.store:
+            scan_codes |= self.store.hotkeys.keys()
+        self.unique_scan_codes = scan_codes
+        self.watched[:] = scan_bitmap(scan_codes)  # in place, the backend may hold it
+        self.build_suppression()
+
+    def build_suppression(self) -> None:
+        idle = bytearray(256)
+        menus: dict[int, bytearray] = {}
+        for menu_keycode, menu in (self.macros.snapshot.menus.items() if self.macros else ()):
+            if menu_keycode == -1:
+                targets = idle  # solo keys
+            else:
+                if 0 <= menu_keycode < 256:
+                    idle[menu_keycode] = 1
+                if self.store and menu_keycode in self.store.hotkeys:
+                    continue  # the profile switch wins, it never opens the menu
+                targets = menus[menu_keycode] = bytearray(256)
+            for keycode in menu:
+                if 0 <= keycode < 256:
+                    targets[keycode] = 1
+        if self.store:
+            for keycode in self.store.hotkeys:
+                if 0 <= keycode < 256:
+                    idle[keycode] = 1
+
+        self.idle_table[:] = idle
+        self.menu_tables = menus
+        if self.suppress_table is not self.pass_all:
+            self.suppress_table = menus.get(self.current_menu, self.idle_table) if self.current_menu is not None else self.idle_table
+
+    def switch_profile(self, name: str) -> None:
+        """ Swaps in another stored profile without parsing anything. """
+        macros = self.store.get(name) if self.store else None
+        if not macros or macros is self.macros:
+            return
+
+        logging.log(logging.INFO, f'Switching to profile {name}')
+        self.set_macros(macros, name)
+
+    def load(self, filename: str) -> None:
+        """ Loads a config file, replacing the current macros. """
+        macros = Macros(filename)
+        if self.store:
+            name = profile_name(filename)
+            self.store.put(name, macros, filename)
+            self.set_macros(macros, name)
+        else:
+            self.set_macros(macros, None)
+
+    def reload(self) -> None:
+        filename = self.store.sources.get(self.profile) if self.store and self.profile else None
+        if not filename:
+            raise ValueError('The current macros were not loaded from a file.')
+        self.load(filename)
+
+    def pause(self) -> None:
+        with self.lock:
+            self.paused = True
+            self.close_menu()
+            self.suppress_table = self.pass_all
+
+    def resume(self) -> None:
+        with self.lock:
+            self.paused = False
+            self.suppress_table = self.idle_table
+
+    def open_menu(self, keycode: int) -> None:
+        self.current_menu = keycode
+        self.menu_opened = self.clock()
+        metrics.menus_opened.inc()
+        self.menu_events.append(keycode)
+        # One timer at a time, it follows reopened menus itself, so the hook rarely has to wake the loop
+        if self.unhook is not None and not self.menu_timer_pending:
+            self.menu_timer_pending = True
+            core.call_later(self.menu_close_delay, self.menu_timer)
+
+    def close_menu(self) -> None:
+        if self.current_menu is not None:
+            self.current_menu = None
+            self.menu_opened = None
+            self.menu_events.append(None)
+
+    def expire_menu(self) -> Optional[float]:
+        """ Closes the menu if nothing was chosen in time. Returns how long an open menu has left. """
+        with self.lock:
+            if self.menu_opened is None:
+                return None
+            left = self.menu_opened + self.menu_close_delay - self.clock()
+            if left < 0:
+                metrics.menus_expired.inc()
+                self.close_menu()
+                return None
+            return left
+
+    def menu_timer(self) -> None:
+        # Loop timers may fire a little early, and a reopened menu gets more time
+        with self.lock:
+            left = self.expire_menu()
+            if left is None:
+                self.menu_timer_pending = False
+                return
+        core.call_later(left + 0.001, self.menu_timer)
+
+    def expire(self) -> None:
+        """ Closes the menu if nothing was chosen in time, and is the UI's idle moment. """
+        self.expire_menu()
+        latency.idle()
+
+    def play(self, macro: Macro) -> None:
+        assert self.macros is not None
+        self.macros.scheduler.submit(macro)
+
+    def key_handler(self, keycode: int) -> None:
+        # The UI edits macros on its own thread, so read their published snapshot, once, without a lock.
+        # The lock is only taken to open or close the menu, which the menu timer and the UI also do
+        macros = self.macros
+        if macros is None:
+            return
+        snapshot = macros.snapshot
+        menu = self.current_menu
+        if menu is None:
+            if self.store and keycode in self.store.hotkeys:
+                self.switch_profile(self.store.hotkeys[keycode])
+
+            elif keycode in snapshot.menus:
+                with self.lock:
+                    if not self.paused and self.macros is macros:  # not paused or switched meanwhile
+                        self.open_menu(keycode)
+
+            elif macro := snapshot.get_macro(None, keycode):
+                self.play(macro)
+
+        elif macro := snapshot.get_macro(menu, keycode):
+            with self.lock:
+                if self.current_menu != menu:
+                    return  # it expired just before the key
+                self.close_menu()
+            self.play(macro)
+
+    def keyloop(self, scan_code: int, down: bool, passed: bool = False) -> None:
+        start = perf_counter()
+        latency.tune_thread()
+        metrics.hook_events.inc()
+        try:
+            self.handle_event(scan_code, down, passed)
+        finally:
+            metrics.hook_seconds.observe(perf_counter() - start)
+
+    def decide(self, scan_code: int, down: bool) -> bool:
+        """
+            Whether the game should see this key. Runs inside the OS hook, so only looks at bitmaps.
+            It follows the menu opening, closing and timing out itself, so the next key is decided
+            right even while the engine loop hasn't handled this one yet.
+        """
+        if scan_code >= 256:
+            return True
+        if down:
+            if self.swallowed[scan_code]:
+                return False
+            table = self.suppress_table
+            if table is not self.idle_table and table is not self.pass_all and self.clock() > self.menu_deadline:
+                table = self.suppress_table = self.idle_table  # the menu timed out
+            if table[scan_code]:
+                self.swallowed[scan_code] = 1
+                if table is self.idle_table:
+                    menu = self.menu_tables.get(scan_code)
+                    if menu is not None:
+                        self.menu_deadline = self.clock() + self.menu_close_delay
+                        self.suppress_table = menu
+                else:
+                    self.suppress_table = self.idle_table  # an activation key closes the menu
+                return False
+            return True
+        if self.swallowed[scan_code]:
+            self.swallowed[scan_code] = 0
+            return False
+        return True
+
+    def filter(self, scan_code: int, down: bool) -> bool:
+        """ The suppressing hook: decides, then leaves the handling to the engine loop. """
+        allow = self.decide(scan_code, down)
+        if scan_code < 256 and self.watched[scan_code]:
+            core.call(self.handle_queued, scan_code, down, allow)
+        else:
+            metrics.hook_events.inc()
+            metrics.hook_filtered.inc()
+        return allow
+
+    def handle_queued(self, scan_code: int, down: bool, passed: bool) -> None:
+        try:
+            self.keyloop(scan_code, down, passed)
+        except Exception:
+            logging.exception('Failed to handle a key event')
+
+    def inject(self, scan_code: int, down: bool) -> None:
+        """ Feeds a key event that didn't come from the hook, e.g. from the control socket. """
+        if self.suppress:
+            core.call(self.handle_queued, scan_code, down, False)  # queued behind the hook's keys
+        else:
+            self.keyloop(scan_code, down)
+
+    def handle_event(self, scan_code: int, down: bool, passed: bool = False) -> None:
+        """ Handles a key event. With `passed` the hook let the game see the key, so it doesn't trigger anything. """
+        if scan_code >= 256 or not self.watched[scan_code]:
+            metrics.hook_filtered.inc()
+            return
+
+        if logging.root.isEnabledFor(logging.INFO):
+            logging.log(logging.INFO, f'Key {"down" if down else "up"}: {get_keyname(scan_code)} [{scan_code}]')
+        # Only the thread delivering key events touches down_keys, so repeats are told apart without a lock
+        if down:
+            if scan_code in self.down_keys:
+                return
+            self.down_keys.add(scan_code)
+            if not self.paused and not passed:
+                self.key_handler(scan_code)
+        else:
+            self.down_keys.discard(scan_code)
+
+    def find_macro(self, name: Optional[str] = None, menu: Optional[str] = None, key: Optional[str] = None) -> Optional[Macro]:
+        """ Finds a macro by name, or by its menu and activation keys (names or scan codes). """
+        if not self.macros:
+            return None
+        if name is not None:
+            for macro in self.macros.get_all():
+                if macro.name == name:
+                    return macro
+            return None
+        return self.macros.snapshot.get_macro(parse_key(menu) if menu else -1, parse_key(key) if key else None)
+
+    def trigger(self, name: Optional[str] = None, menu: Optional[str] = None, key: Optional[str] = None) -> Macro:
+        """ Plays a macro as if its keys had been pressed. """
+        with self.lock:
+            macro = self.find_macro(name, menu, key)
+            if macro is None:
+                raise KeyError(f'No macro matches name={name!r} menu={menu!r} key={key!r}')
+            self.play(macro)
+            return macro
+
+    def state(self) -> dict:
+        scheduler = self.macros.scheduler.stats() if self.macros else {}
+        return {
+            'profile': self.profile,
+            'macros': len(self.macros.get_all()) if self.macros else 0,
+            'paused': self.paused,
+            'hooked': self.unhook is not None,
+            'current_menu': get_keyname(self.current_menu, None) if self.current_menu else None,
+            'scheduler': scheduler,
+        }
+
+
+def parse_key(key) -> int:
+    """ Accepts a scan code, or a key name like 'F1', 'Np5' or '1' (names win over numbers in strings). """
+    if isinstance(key, int):
+        return key
+    code = keyname_to_code.get(key.lower())
+    if code is None and key.isdigit():
+        code = int(key)
+    if code is None:
+        raise KeyError(f'Unknown key {key!r}')
+    return code
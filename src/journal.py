@@ -0,0 +1,220 @@
+# MIT License
+
+# Copyright (c) 2023 ElliotCS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+    An append-only log of edits kept next to a config (quickchats.yml.journal), so saving
+    one change costs one small write and a crash loses nothing.
+
+    Each line is a JSON record keyed by the macro's (menu, activation) keys:
+
+        {"op": "put", "key": [59, 2], "name": "Nice shot!", "macro": {...}}
+        {"op": "del", "key": [59, 2]}
+
+    Loading replays the journal on top of the config. Saving compacts: it writes the current
+    macros as the new config in the background and starts a fresh journal. Edits made since
+    the last save are in the journal too, so they survive a crash, and closing the editor
+    without saving discards them by cutting the journal back to where it was at that save.
+"""
+
+from __future__ import annotations
+from typing import Optional, TYPE_CHECKING
+if TYPE_CHECKING:
+    from macros import Macro, Macros
+from threading import Lock, Thread
+from loader import dumps
+from keycodes import normalize_code
+import json
+import logging
+import os
+
+Key = tuple[int, int]
+
+
+def journal_path(filename: str) -> str:
+    return filename + '.journal'
+
+
+def compacting_path(filename: str) -> str:
+    """ Where the journal goes while its records are being folded into the config. """
+    return filename + '.journal.compacting'
+
+
+def macro_key(macro: Macro) -> Key:
+    return macro.menu_keycode, macro.activation_keycode
+
+
+def entry_key(entry: dict) -> Key:
+    return normalize_code(entry.get('menu_keycode', -1)), normalize_code(entry['activation_keycode'])
+
+
+def replay(filename: str, data: dict) -> tuple[dict, int]:
+    """ Applies the config's journals to its loaded data. Returns the data and how many records were applied. """
+    names = {entry_key(entry): name for name, entry in data.items()}
+    count = 0
+    for path in (compacting_path(filename), journal_path(filename)):
+        if not os.path.exists(path):
+            continue
+        with open(path, 'r', encoding='utf-8') as f:
+            for number, line in enumerate(f, 1):
+                try:
+                    record = json.loads(line)
+                    key = tuple(record['key'])
+                    op = record['op']
+                    if op == 'put':
+                        name, entry = record['name'], record['macro']
+                    elif op != 'del':
+                        raise ValueError(op)
+                except (ValueError, KeyError, TypeError):
+                    # A crash mid-write leaves a torn last line, everything before it is good
+                    logging.log(logging.WARNING, f'Skipping bad journal record {path}:{number}')
+                    continue
+
+                old = names.pop(key, None)
+                if old is not None:
+                    data.pop(old, None)
+                if op == 'put':
+                    if name in data:
+                        name = f'{name} ({key[1]})'  # the same rename Macros.to_data does
+                    data[name] = entry
+                    names[key] = name
+                count += 1
+
+    if count:
+        logging.log(logging.INFO, f'Replayed {count} journal records for {filename}')
+    return data, count
+
+
+class Journal:
+    """
+        Records every change Macros notifies about. Only complete macros are journaled,
+        so the config plus its journal always matches `Macros.to_data(force=True)`.
+        `saved` is the journal's length at the last save, which `discard` cuts it back to.
+    """
+
+    def __init__(self, filename: str, records: int = 0) -> None:
+        self.filename = filename
+        self.path = journal_path(filename)
+        self.file = None
+        self.records = records
+        self.keys: dict[Macro, Key] = {}
+        self.macros: Optional[Macros] = None
+        self.lock = Lock()
+        self.compactor: Optional[Thread] = None
+        self.saved = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+
+    def attach(self, macros: Macros) -> None:
+        self.macros = macros
+        for macro in macros.get_all():
+            if macro.is_valid():
+                self.keys[macro] = macro_key(macro)
+        macros.subscribe(self.on_change)
+
+    def detach(self) -> None:
+        if self.macros:
+            self.macros.unsubscribe(self.on_change)
+        self.close()
+
+    def on_change(self, changes: list[tuple[str, Macro]]) -> None:
+        for kind, macro in changes:
+            old = self.keys.get(macro)
+            entry = macro.to_dict() if kind != 'remove' else None
+            key = macro_key(macro)
+
+            if old is not None and (entry is None or old != key):
+                self.append({'op': 'del', 'key': old})
+                del self.keys[macro]
+            if entry is not None:
+                self.append({'op': 'put', 'key': key, 'name': macro.name, 'macro': entry})
+                self.keys[macro] = key
+
+    def append(self, record: dict) -> None:
+        with self.lock:
+            if self.file is None:
+                self.file = open(self.path, 'a', encoding='utf-8')
+            self.file.write(json.dumps(record, ensure_ascii=False) + '\n')
+            self.file.flush()
+            self.records += 1
+
+    def sync(self) -> None:
+        """ Makes everything appended so far survive a power cut, not just a crash. """
+        with self.lock:
+            if self.file is not None:
+                self.file.flush()
+                os.fsync(self.file.fileno())
+
+    def discard(self) -> None:
+        """ Drops the records appended since the last save. The macros in memory keep the edits, so throw them away too. """
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            if os.path.exists(self.path) and os.path.getsize(self.path) > self.saved:
+                os.truncate(self.path, self.saved)
+                logging.log(logging.INFO, f'Discarded unsaved changes to {self.filename}')
+
+    def close(self) -> None:
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+    def compact(self) -> Optional[Thread]:
+        """ Starts folding the journal into the config on a background thread. """
+        assert self.macros is not None
+        with self.lock:
+            if self.compactor is not None and self.compactor.is_alive():
+                # This save stays in the journal until the next compaction, so discard must keep it
+                self.saved = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+                return None
+            if os.path.exists(compacting_path(self.filename)):
+                # A previous compaction never finished, fold that journal in first
+                self.finish_compaction(self.macros.to_data(force=True))
+
+            # Everything in the journal is in this snapshot, later edits go to a fresh journal
+            data = self.macros.to_data(force=True)
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+            if os.path.exists(self.path):
+                os.replace(self.path, compacting_path(self.filename))
+            self.records = 0
+            self.saved = 0
+
+            self.compactor = Thread(target=self.finish_compaction, args=(data,), name='Compaction', daemon=True)
+            self.compactor.start()
+            return self.compactor
+
+    def finish_compaction(self, data: dict) -> None:
+        temporary = self.filename + '.tmp'
+        try:
+            with open(temporary, 'w', encoding='utf-8') as f:
+                f.write(dumps(data, self.filename))
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(temporary, self.filename)
+            if os.path.exists(compacting_path(self.filename)):
+                os.remove(compacting_path(self.filename))
+            logging.log(logging.INFO, f'Compacted {len(data)} macros into {self.filename}')
+        except Exception:
+            # The compacting journal stays, and is replayed on the next load
+            logging.exception(f'Failed to compact the journal of {self.filename}')
@@ -21,33 +21,19 @@
 # SOFTWARE.
 
 
+import keyboard
+
+
 UNKNOWN_KEY = '�'
 
-scancode_to_keyname = {
-    14: 'Bkspce',
-    15: 'Tab',
-    28: 'Enter',
-    29: 'Ctrl',
-    42: 'Shift',
-    56: 'Alt',
-    69: 'Nmlk',
-    70: 'Scrlk',
-    71: 'Np7',
-    72: 'Np8',
-    73: 'Np9',
-    74: 'Np-',
-    75: 'Np4',
-    76: 'Np5',
-    77: 'Np6',
-    78: 'Np+',
-    79: 'Np1',
-    80: 'Np2',
-    81: 'Np3',
-    82: 'Np0',
-    83: 'Np.',
-    86: '<',
-    87: 'F11',
-    88: 'F12',
+# Config values are hardware scan codes (what the keyboard hook reports) unless they carry
+# VK_FLAG, in which case the low bits are a Windows virtual-key code.
+SCAN = 0
+VK = 1
+VK_FLAG = 1 << 16
+SHIFT_FLAG = 1 << 8
+
+scan_keynames = {
     1: 'Esc',
     2: '1',
     3: '2',
@@ -61,6 +47,8 @@ scancode_to_keyname = {
     11: '0',
     12: '-',
     13: '=',
+    14: 'Bkspce',
+    15: 'Tab',
     16: 'Q',
     17: 'W',
     18: 'E',
@@ -74,6 +62,7 @@ scancode_to_keyname = {
     26: '[',
     27: ']',
     28: 'Enter',
+    29: 'Ctrl',
     30: 'A',
     31: 'S',
     32: 'D',
@@ -86,6 +75,7 @@ scancode_to_keyname = {
     39: ';',
     40: "'",
     41: '`',
+    42: 'Shift',
     43: '\\',
     44: 'Z',
     45: 'X',
@@ -99,6 +89,7 @@ scancode_to_keyname = {
     53: '/',
     54: 'RShift',
     55: 'Np*',
+    56: 'Alt',
     57: 'Space',
     58: 'CapsLock',
     59: 'F1',
@@ -134,6 +125,9 @@ scancode_to_keyname = {
     93: 'Menu',
     94: 'Power',
     95: 'Sleep',
+}
+
+vk_keynames = {
     96: 'Np0',
     97: 'Np1',
     98: 'Np2',
@@ -176,6 +170,92 @@ scancode_to_keyname = {
     222: "'",
 }
 
+# Dense forward tables, indexed by the raw code of each space
+scan_table: list = [None] * 256
+for code, name in scan_keynames.items():
+    scan_table[code] = name
+
+vk_table: list = [None] * 256
+for code, name in vk_keynames.items():
+    vk_table[code] = name
+
+# Every code we can name: scan codes as they are, virtual-key codes tagged with VK_FLAG
+scancode_to_keyname = scan_keynames | {code | VK_FLAG: name for code, name in vk_keynames.items()}
+
+# Reverse index, preferring the scan code when both spaces name the same key
+keyname_to_code: dict[str, int] = {}
+for code, name in scancode_to_keyname.items():
+    keyname_to_code.setdefault(name.lower(), code)
+
+SHIFT_SCAN_CODE = 42
+ENTER_SCAN_CODE = 28
+
+
+def space_of(code: int) -> int:
+    return VK if code & VK_FLAG else SCAN
+
+def vk(code: int) -> int:
+    """ Tags a Windows virtual-key code so it can't be mistaken for a scan code. """
+    return code | VK_FLAG
+
 def get_keyname(scan_code, default=UNKNOWN_KEY):
-    return scancode_to_keyname.get(scan_code, default)
+    if scan_code is None or scan_code < 0:
+        return default
+    if scan_code & VK_FLAG:
+        table = vk_table
+        scan_code ^= VK_FLAG
+    else:
+        table = scan_table
+    if scan_code >= 256:
+        return default
+    return table[scan_code] or default
+
+# Character -> scan code (| SHIFT_FLAG), as the current keyboard layout types it, 0 for none
+layout_codes: dict[str, int] = {}
+
+def char_code(char: str) -> int:
+    """
+        Returns the scan code (| SHIFT_FLAG) that types `char` on the current keyboard layout,
+        or 0 if it takes other modifiers or isn't on the keyboard. The layout is asked through
+        the keyboard library, the way keyboard.write does, once per character.
+    """
+    code = layout_codes.get(char)
+    if code is None:
+        code = layout_codes[char] = layout_code(char)
+    return code
+
+def layout_code(char: str) -> int:
+    if char == '\n':
+        return ENTER_SCAN_CODE
+    try:
+        entries = list(keyboard._os_keyboard.map_name(keyboard.normalize_name(char)))
+    except Exception:
+        return 0  # not on this layout, or the OS tables can't be read (e.g. Linux without root)
+    for scan_code, modifiers in sorted(entries, key=lambda entry: len(entry[1])):
+        if scan_code <= 0 or scan_code >= 256:
+            continue  # only a virtual-key code
+        if not modifiers:
+            return scan_code
+        if tuple(modifiers) == ('shift',):
+            return scan_code | SHIFT_FLAG
+    return 0
+
+def is_valid_code(code: int) -> bool:
+    return code == -1 or get_keyname(code, None) is not None
+
+def normalize_code(code: int) -> int:
+    """
+        Older configs could hold untagged virtual-key codes (e.g. 112 for F1).
+        Tag those so they stop colliding with scan codes. Unknown codes are returned unchanged.
+    """
+    if 0 <= code < 256 and scan_table[code] is None and vk_table[code] is not None:
+        return code | VK_FLAG
+    return code
 
+def scan_bitmap(codes) -> bytearray:
+    """ A lookup table with a 1 at every scan code in `codes`. """
+    bitmap = bytearray(256)
+    for code in codes:
+        if 0 <= code < 256:
+            bitmap[code] = 1
+    return bitmap
@@ -0,0 +1,173 @@
+# MIT License
+
+# Copyright (c) 2023 ElliotCS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+    Key event traces: a short header followed by fixed-width records of
+    (seconds since the start of the recording, scan code, is down).
+
+    Traces are memory-mapped for reading, so replaying one costs no parsing and
+    stays cheap for recordings of any length.
+
+        python src/keytrace.py replay session.trace quickchats.yml [--realtime]
+"""
+
+from __future__ import annotations
+from typing import Iterator
+from engine import Engine
+from struct import Struct
+from time import perf_counter, sleep
+import argparse
+import logging
+import mmap
+import metrics
+
+MAGIC = b'EMTRACE1'
+record = Struct('<dH?x')  # 12 bytes per event
+
+
+class TraceRecorder:
+    """ A hook callback that writes every event it sees to a trace file, buffered in memory between flushes. """
+
+    flush_size = 4096
+
+    def __init__(self, filename: str) -> None:
+        self.file = open(filename, 'wb')
+        self.file.write(MAGIC)
+        self.buffer = bytearray()
+        self.start = perf_counter()
+        self.count = 0
+
+    def __call__(self, scan_code: int, down: bool) -> None:
+        self.buffer += record.pack(perf_counter() - self.start, scan_code & 0xFFFF, down)
+        self.count += 1
+        if len(self.buffer) >= self.flush_size * record.size:
+            self.flush()
+
+    def flush(self) -> None:
+        self.file.write(self.buffer)
+        self.buffer.clear()
+        self.file.flush()
+
+    def close(self) -> None:
+        if not self.file.closed:
+            self.flush()
+            self.file.close()
+            logging.log(logging.INFO, f'Recorded {self.count} key events to {self.file.name}')
+
+
+class Trace:
+    """ A recorded trace, memory-mapped read-only. Iterating yields (time, scan_code, down). """
+
+    def __init__(self, filename: str) -> None:
+        with open(filename, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f'{filename} is not a key event trace.')
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        # A recording cut short can end in a partial record, which is ignored
+        end = len(MAGIC) + (len(self.map) - len(MAGIC)) // record.size * record.size
+        self.view = memoryview(self.map)[len(MAGIC):end]
+
+    def __len__(self) -> int:
+        return len(self.view) // record.size
+
+    def __iter__(self) -> Iterator[tuple[float, int, bool]]:
+        return record.iter_unpack(self.view)
+
+    def duration(self) -> float:
+        if not len(self):
+            return 0.0
+        return record.unpack_from(self.view, len(self.view) - record.size)[0]
+
+    def close(self) -> None:
+        self.view.release()
+        self.map.close()
+
+
+def write_trace(filename: str, events: list[tuple[float, int, bool]]) -> None:
+    """ Writes events to a trace file in one go, e.g. a synthetic trace for benchmarks. """
+    with open(filename, 'wb') as f:
+        f.write(MAGIC)
+        f.write(b''.join(record.pack(time, scan_code, down) for time, scan_code, down in events))
+
+
+def replay(trace: Trace, engine: Engine, realtime: bool = False) -> int:
+    """
+        Feeds a trace through the engine. The engine's clock follows the trace, so menus
+        time out exactly as they did when it was recorded, however fast it is replayed.
+        With `realtime` it also waits between events as long as the recording did, and
+        events go through the timed hook entry point so the hook metrics are realistic.
+    """
+    now = 0.0
+    clock = engine.clock
+    engine.clock = lambda: now
+    keyloop = engine.keyloop if realtime else engine.handle_event
+    expire = engine.expire
+    started = perf_counter()
+    count = 0
+    try:
+        for now, scan_code, down in trace:
+            if realtime and (delay := now - (perf_counter() - started)) > 0:
+                sleep(delay)
+            # The overlay checks for expired menus every frame, here before every event
+            if engine.menu_opened is not None:
+                expire()
+            keyloop(scan_code, down)
+            count += 1
+        expire()
+    finally:
+        engine.clock = clock
+        if not realtime:
+            metrics.hook_events.inc(count)
+    return count
+
+
+if __name__ == '__main__':
+    from backends import FakeBackend
+    from macros import Macros
+
+    parser = argparse.ArgumentParser(description='Replay a recorded key event trace against a config.')
+    parser.add_argument('command', choices=['replay', 'info'])
+    parser.add_argument('trace')
+    parser.add_argument('config', nargs='?')
+    parser.add_argument('--realtime', action='store_true', help='replay at the recorded speed')
+    args = parser.parse_args()
+
+    trace = Trace(args.trace)
+    print(f'{len(trace)} events over {trace.duration():.1f} seconds')
+    if args.command == 'replay':
+        if not args.config:
+            parser.error('replay needs a config')
+        logging.disable(logging.CRITICAL)
+        backend = FakeBackend()
+        engine = Engine(Macros(args.config), backend)
+        played: list = []
+        engine.play = played.append  # type: ignore  # list what was triggered instead of rate limiting it
+        # Not started: nothing is hooked, and replay() drives menu timeouts from the trace's own clock
+
+        start = perf_counter()
+        count = replay(trace, engine, args.realtime)
+        elapsed = perf_counter() - start
+        print(f'Replayed {count} events in {elapsed:.3f} s ({count / elapsed:,.0f} events per second)')
+        for macro in played:
+            print(f'  played {macro.name}')
+    trace.close()
@@ -0,0 +1,154 @@
+# MIT License
+
+# Copyright (c) 2023 ElliotCS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+    Opt-in latency mode, for when the game is hogging the CPU.
+
+    - The cyclic garbage collector is switched off, and the loaded config is moved out of
+      its reach with gc.freeze(), so no collection walks it again. After a switch the
+      freeze waits for `idle`, so its full collection never delays the keys that follow.
+    - Collections happen only in `idle`, which the UI frame loop calls, and never while
+      a macro is playing.
+    - The hook and playback threads can be given a higher priority and pinned to CPUs,
+      where the OS allows it.
+"""
+
+from contextlib import contextmanager
+from threading import Lock, get_native_id
+from typing import Iterator, Optional
+import gc
+import logging
+import os
+import sys
+
+if sys.platform == 'win32':
+    import ctypes
+    kernel32 = ctypes.windll.kernel32  # type: ignore
+    THREAD_PRIORITY_HIGHEST = 2
+    ABOVE_NORMAL_PRIORITY_CLASS = 0x8000
+
+NICE = -10
+
+
+class LatencyMode:
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.priority = False
+        self.cpus: Optional[set[int]] = None
+        self.playing_count = 0
+        self.freeze_due = False
+        self.lock = Lock()
+        self.tuned: set[int] = set()
+
+    def enable(self, priority: bool = True, cpus: Optional[set[int]] = None) -> None:
+        self.enabled = True
+        self.priority = priority
+        self.cpus = cpus
+        gc.disable()
+        if priority and sys.platform == 'win32':
+            if not kernel32.SetPriorityClass(kernel32.GetCurrentProcess(), ABOVE_NORMAL_PRIORITY_CLASS):
+                logging.log(logging.WARNING, 'Could not raise the process priority')
+        self.freeze()
+        logging.log(logging.INFO, f'Latency mode on (priority: {priority}, cpus: {sorted(cpus) if cpus else "any"})')
+
+    def disable(self) -> None:
+        self.enabled = False
+        gc.unfreeze()
+        gc.enable()
+
+    def freeze(self) -> None:
+        """ Moves everything alive into the permanent generation. Unfreezes first so a replaced config can still be freed. """
+        if not self.enabled:
+            return
+        self.freeze_due = False
+        gc.unfreeze()
+        gc.collect()
+        gc.freeze()
+        logging.log(logging.INFO, f'Froze {gc.get_freeze_count()} objects')
+
+    @contextmanager
+    def playing(self) -> Iterator[None]:
+        """ Marks a playback window, `idle` won't collect during one. """
+        with self.lock:
+            self.playing_count += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.playing_count -= 1
+
+    def freeze_soon(self) -> None:
+        """ Called after other macros are swapped in: `idle` freezes them once nothing is playing. """
+        self.freeze_due = self.enabled
+
+    def idle(self) -> None:
+        """ Runs the collection the disabled collector would have, if one is due and nothing is playing. """
+        if not self.enabled or self.playing_count:
+            return
+        if self.freeze_due:
+            self.freeze()
+            return
+        counts = gc.get_count()
+        thresholds = gc.get_threshold()
+        due = [generation for generation in range(3) if thresholds[generation] and counts[generation] >= thresholds[generation]]
+        if due:
+            gc.collect(due[-1])
+
+    def tune_thread(self) -> None:
+        """ Raises the calling thread's priority and pins it, once per thread. """
+        if not self.enabled or not (self.priority or self.cpus):
+            return
+        thread_id = get_native_id()
+        if thread_id in self.tuned:
+            return
+        self.tuned.add(thread_id)
+
+        try:
+            if sys.platform == 'win32':
+                thread = kernel32.GetCurrentThread()
+                if self.priority and not kernel32.SetThreadPriority(thread, THREAD_PRIORITY_HIGHEST):
+                    logging.log(logging.WARNING, 'Could not raise the thread priority')
+                if self.cpus and not kernel32.SetThreadAffinityMask(thread, sum(1 << cpu for cpu in self.cpus)):
+                    logging.log(logging.WARNING, f'Could not pin the thread to CPUs {sorted(self.cpus)}')
+                return
+
+            if self.cpus and hasattr(os, 'sched_setaffinity'):
+                os.sched_setaffinity(thread_id, self.cpus)
+            if self.priority and hasattr(os, 'setpriority'):
+                # On Linux this applies to the one thread. Lowering niceness needs CAP_SYS_NICE
+                os.setpriority(os.PRIO_PROCESS, thread_id, NICE)
+        except OSError as e:
+            logging.log(logging.WARNING, f'Could not tune thread {thread_id}: {e}')
+
+
+latency = LatencyMode()
+
+
+def parse_cpus(text: str) -> set[int]:
+    """ '2,3' or '2-5' -> a set of CPU numbers. """
+    cpus = set()
+    for part in text.split(','):
+        start, _, end = part.strip().partition('-')
+        cpus.update(range(int(start), int(end or start) + 1))
+    return cpus
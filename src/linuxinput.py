@@ -0,0 +1,225 @@
+# MIT License
+
+# Copyright (c) 2023 ElliotCS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+    A Linux hook backend that reads every keyboard's evdev device directly, in one epoll
+    loop on one thread. Playback still goes through the keyboard library.
+
+    Events are read many at a time straight into a buffer, and their type and code are
+    checked through a memoryview of it, so events for keys no macro uses are skipped
+    without building any Python objects for them. Devices that appear later are picked
+    up by a periodic rescan, and devices that disappear are dropped.
+
+    Reading /dev/input needs root or membership of the `input` group.
+"""
+
+from typing import Callable, Optional
+from backends import Callback, KeyboardBackend
+import metrics
+from threading import Lock, Thread
+from struct import Struct, calcsize
+import errno
+import fcntl
+import glob
+import logging
+import os
+import select
+import time
+
+input_event = Struct('@llHHi')  # struct timeval, type, code, value
+TYPE_OFFSET = calcsize('@ll')
+EV_KEY = 1
+
+KEY_BITS = 0x300 // 8
+
+
+def EVIOCGBIT(ev: int, length: int) -> int:
+    return (2 << 30) | (length << 16) | (ord('E') << 8) | (0x20 + ev)
+
+
+def is_keyboard(fd: int) -> bool:
+    """ Whether the device reports any of the keys below 256, where keyboards and macro pads live. """
+    bits = bytearray(KEY_BITS)
+    try:
+        fcntl.ioctl(fd, EVIOCGBIT(EV_KEY, KEY_BITS), bits)
+    except OSError:
+        return False
+    return any(bits[:32])
+
+
+class EvdevBackend(KeyboardBackend):
+    """
+        Hook callbacks get (scan_code, is_down), like KeyboardBackend's. A callback can be
+        given a 256-entry bitmap of the scan codes it wants, and sees nothing else.
+        Autorepeats are reported as downs.
+    """
+
+    rescan_interval = 2.0
+    batch = 64  # events per read
+
+    def __init__(self, pattern: Optional[str] = '/dev/input/event*') -> None:
+        self.pattern = pattern
+        self.epoll = select.epoll()
+        self.devices: dict[int, str] = {}  # fd -> path
+        self.rejected: set[str] = set()  # paths that aren't keyboards or we may not read
+        self.hooks: list[tuple[Callback, Optional[bytearray]]] = []
+        self.lock = Lock()
+        self.thread: Optional[Thread] = None
+        self.running = False
+        self.last_scan = 0.0
+
+        self.wake_read, self.wake_write = os.pipe()
+        self.epoll.register(self.wake_read, select.EPOLLIN)
+
+        self.buffer = bytearray(input_event.size * self.batch)
+        self.words = memoryview(self.buffer).cast('H')
+
+    def hook(self, callback: Callback, watched: Optional[bytearray] = None, suppress: bool = False) -> Callable[[], None]:
+        if suppress:
+            # That would need grabbing the devices and re-injecting everything else through uinput
+            logging.log(logging.WARNING, 'The evdev backend cannot suppress keys, they will reach the game')
+        entry = (callback, watched)
+        with self.lock:
+            self.hooks = self.hooks + [entry]
+        self.start()
+
+        def unhook() -> None:
+            with self.lock:
+                self.hooks = [hook for hook in self.hooks if hook is not entry]
+        return unhook
+
+    def add_device(self, fd: int, name: str) -> None:
+        """ Watches an open file descriptor as a device. Tests pass the read end of a pipe. """
+        os.set_blocking(fd, False)
+        self.devices[fd] = name
+        self.epoll.register(fd, select.EPOLLIN)
+        logging.log(logging.INFO, f'Watching input device {name}')
+
+    def remove_device(self, fd: int) -> None:
+        name = self.devices.pop(fd, None)
+        if name is None:
+            return
+        try:
+            self.epoll.unregister(fd)
+        except (OSError, ValueError):
+            pass
+        os.close(fd)
+        logging.log(logging.INFO, f'Input device {name} went away')
+
+    def scan(self) -> None:
+        """ Opens keyboards that aren't watched yet. Paths already turned down are skipped until they go away. """
+        self.last_scan = time.monotonic()
+        if not self.pattern:
+            return
+        paths = glob.glob(self.pattern)
+        self.rejected.intersection_update(paths)  # a replugged device may get a freed path
+        watching = set(self.devices.values())
+        for path in paths:
+            if path in watching or path in self.rejected:
+                continue
+            try:
+                fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+            except PermissionError:
+                logging.log(logging.WARNING, f'No permission to read {path}, add yourself to the input group')
+                self.rejected.add(path)
+                continue
+            except OSError:
+                continue
+            if is_keyboard(fd):
+                self.add_device(fd, path)
+            else:
+                os.close(fd)
+                self.rejected.add(path)
+
+    def start(self) -> None:
+        if self.thread is None:
+            self.running = True
+            self.scan()
+            self.thread = Thread(target=self.run, name='Evdev', daemon=True)
+            self.thread.start()
+
+    def close(self) -> None:
+        self.running = False
+        os.write(self.wake_write, b'\0')
+        if self.thread is not None:
+            self.thread.join(1.0)
+            self.thread = None
+        for fd in list(self.devices):
+            self.remove_device(fd)
+
+    def run(self) -> None:
+        while self.running:
+            ready = self.epoll.poll(self.rescan_interval)
+            for fd, mask in ready:
+                if fd == self.wake_read:
+                    os.read(fd, 64)
+                else:
+                    self.read(fd)
+            if time.monotonic() - self.last_scan >= self.rescan_interval:
+                self.scan()
+
+    def read(self, fd: int) -> None:
+        while True:
+            try:
+                count = os.readv(fd, [self.buffer])
+            except BlockingIOError:
+                return
+            except OSError as e:
+                if e.errno != errno.EINTR:
+                    self.remove_device(fd)  # unplugged, ENODEV
+                return
+            if count == 0:
+                self.remove_device(fd)
+                return
+
+            self.dispatch(count // input_event.size)
+            if count < len(self.buffer):
+                return
+
+    def dispatch(self, events: int) -> None:
+        words = self.words
+        stride = input_event.size // 2
+        hooks = self.hooks
+        filtered = 0
+        for i in range(TYPE_OFFSET // 2, events * stride, stride):
+            if words[i] != EV_KEY:
+                continue
+            code = words[i + 1]
+            down = words[i + 2] != 0  # value: 0 up, 1 down, 2 autorepeat
+            delivered = False
+            for callback, watched in hooks:
+                if watched is None or (code < len(watched) and watched[code]):
+                    callback(code, down)
+                    delivered = True
+            if not delivered:
+                filtered += 1
+        if filtered:
+            # The engine only counts the events it is given
+            metrics.hook_events.inc(filtered)
+            metrics.hook_filtered.inc(filtered)
+
+
+def pack_event(code: int, value: int, type: int = EV_KEY) -> bytes:
+    """ One input_event, for feeding fake devices. """
+    now = time.time()
+    return input_event.pack(int(now), int(now % 1 * 1_000_000), type, code, value)
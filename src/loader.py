@@ -21,11 +21,14 @@
 # SOFTWARE.
 
 
-from strictyaml import Map, Str, Float, Int, MapPattern, Optional
+from typing import Callable, Iterable, Iterator, Optional as Optional_
+from strictyaml import Map, Str, Int, MapPattern, Optional, Seq
 from strictyaml.representation import OrderedDict
 from strictyaml import load as _load
 
 from strictyaml import as_document
+import json
+import os
 
 
 schema = MapPattern(Str(), Map({
@@ -33,16 +36,155 @@ schema = MapPattern(Str(), Map({
     "activation_keycode": Int(),
     Optional("chat_opener_keycode"): Int(),
     "text": Str(),
+    Optional("priority"): Int(),
+    Optional("actions"): Seq(Str()),
     # Optional("delays"): MapPattern(Float(), Float())
 }))
  # type: ignore
 
+# The same shape as `schema`, for the formats strictyaml doesn't read. Keep the two in sync.
+fields = {
+    'menu_keycode': (int, False),
+    'activation_keycode': (int, True),
+    'chat_opener_keycode': (int, False),
+    'text': (str, True),
+    'priority': (int, False),
+    'actions': (list, False),
+}
+
+yaml_extensions = ('.yml', '.yaml')
+json_extensions = ('.json', '.jsonl')
+config_extensions = yaml_extensions + json_extensions
+
+
+class ConfigError(ValueError):
+
+    def __init__(self, filename: str, errors: list[str]) -> None:
+        super().__init__(f'{filename} has {len(errors)} error(s):\n' + '\n'.join(errors))
+        self.filename = filename
+        self.errors = errors
+
+
+def locate(name: object, where: str) -> str:
+    """ The prefix of every message about one macro: where it is, then which macro it is. """
+    return f'{where}, macro {name!r}' if where else f'macro {name!r}'
+
+
+def compile_schema(fields: dict[str, tuple[type, bool]]) -> Callable[[str, object, str, list[str]], bool]:
+    """ Turns a field table into a single check function that appends every problem it finds to `errors`. """
+    required = frozenset(key for key, (_, is_required) in fields.items() if is_required)
+    types = {key: kind for key, (kind, _) in fields.items()}
+    names = {int: 'an integer', str: 'a string', list: 'a list'}
+
+    def check(name: str, entry: object, where: str, errors: list[str]) -> bool:
+        at = locate(name, where)
+        if type(entry) is not dict:
+            errors.append(f'{at}: must be a mapping')
+            return False
+
+        ok = True
+        for key in required - entry.keys():
+            errors.append(f'{at}: missing {key!r}')
+            ok = False
+        for key, value in entry.items():
+            kind = types.get(key)
+            if kind is None:
+                errors.append(f'{at}: unknown field {key!r}')
+                ok = False
+            elif type(value) is not kind:
+                errors.append(f'{at}: {key!r} must be {names[kind]}, not {value!r}')
+                ok = False
+        return ok
+
+    return check
+
+
+check_macro = compile_schema(fields)
+
+
+def validate(entries: Iterable[tuple[object, object, str]], filename: str, errors: Optional_[list[str]] = None) -> OrderedDict:
+    """
+        Validates (name, macro, location) entries in one pass, raising a ConfigError listing every
+        problem. The location is empty when the name alone says where the macro is.
+    """
+    out = OrderedDict()
+    errors = [] if errors is None else errors
+    for name, entry, where in entries:
+        valid = check_macro(name, entry, where, errors)  # type: ignore
+        if type(name) is not str:
+            errors.append(f'{locate(name, where)}: the name must be a string')
+        elif name in out:
+            errors.append(f'{locate(name, where)}: duplicate name')
+        elif valid:
+            out[name] = entry
+
+    if errors:
+        raise ConfigError(filename, errors)
+    return out
+
+
+def iter_jsonl(f: Iterable[str], errors: list[str]) -> Iterator[tuple[object, object, str]]:
+    """ Streams a JSON Lines config, one {"name": ..., <fields>} object per line. """
+    decode = json.JSONDecoder().decode
+    for number, line in enumerate(f, 1):
+        if not line.strip():
+            continue
+        where = f'line {number}'
+        try:
+            entry = decode(line)
+        except ValueError as e:
+            errors.append(f'{where}: {e}')
+            continue
+        if type(entry) is not dict:
+            errors.append(f'{where}: expected an object, not {entry!r}')
+            continue
+        yield entry.pop('name', None), entry, where
+
+
+class _Pairs(list):
+    pass
+
+
+def iter_json(f, errors: list[str]) -> Iterator[tuple[object, object, str]]:
+    """ Reads a JSON config, a single object of macro names to macros. Keeps duplicate names so they can be reported. """
+    pairs = json.load(f, object_pairs_hook=_Pairs)
+    if type(pairs) is not _Pairs:
+        errors.append('the top level must be an object of macro names to macros')
+        return
+    for name, entry in pairs:
+        yield name, dict(entry) if type(entry) is _Pairs else entry, ''
+
+
 def load(filename: str) -> OrderedDict:
+    ext = os.path.splitext(filename)[1].lower()
+    if ext in json_extensions:
+        errors: list[str] = []
+        with open(filename, 'r', encoding='utf-8') as f:
+            try:
+                return validate((iter_jsonl if ext == '.jsonl' else iter_json)(f, errors), filename, errors)
+            except json.JSONDecodeError as e:
+                raise ConfigError(filename, [str(e)])
+
     stryaml = ''
     with open(filename, 'r') as f:
         stryaml = f.read()
-    
+
     return _load(stryaml, schema).data # type: ignore
 
 def dump(data: dict) -> str:
     return as_document(data, schema).as_yaml()
+
+def dumps(data: dict, filename: str) -> str:
+    """ Serializes `data` in the format matching `filename`'s extension. """
+    ext = os.path.splitext(filename)[1].lower()
+    if ext == '.json':
+        return json.dumps(data, indent=2, ensure_ascii=False) + '\n'
+    if ext == '.jsonl':
+        return ''.join(json.dumps({'name': name} | entry, ensure_ascii=False) + '\n' for name, entry in data.items())
+    return dump(data)
+
+def convert(source: str, destination: str) -> None:
+    """ Converts a config between formats, e.g. quickchats.yml -> quickchats.jsonl. """
+    data = load(source)
+    with open(destination, 'w', encoding='utf-8') as f:
+        f.write(dumps(data, destination))
@@ -22,42 +22,20 @@
 
 
 from __future__ import annotations
-from typing import Optional, TYPE_CHECKING
-if TYPE_CHECKING:
-    from main import MainUI
-    from macros import Macros
-from loader import load, dump
-from keyboard import press, release, read_event
-from time import sleep
-from string import ascii_uppercase
-from tkinter import Button, StringVar, Frame
-from keycodes import scancode_to_keyname, get_keyname
+from typing import Callable, Iterator, Optional
+from contextlib import contextmanager
+from loader import ConfigError, load, dump, dumps
+from backends import KeyboardBackend
+from keycodes import VK_FLAG, get_keyname, is_valid_code, normalize_code
+from scheduler import ChatScheduler
+from actions import ActionError, Program, compile_actions, compile_say, run, run_async
+from analysis import describe, find_conflicts
+from journal import Journal, replay
+import metrics
 import logging
 from strictyaml.exceptions import YAMLValidationError, YAMLSerializationError, MarkedYAMLError
 
-to_shift = {
-    '!': '1',
-    '@': '2',
-    '#': '3',
-    '$': '4',
-    '%': '5',
-    '^': '6',
-    '&': '7',
-    '*': '8',
-    '(': '9',
-    ')': '0',
-    '_': '-',
-    '+': '=',
-    '{': '[',
-    '}': ']',
-    '|': '\\',
-    ':': ';',
-    '"': "'",
-    '<': ',',
-    '>': '.',
-    '?': '/',
-    '~': '`'
-} | {key: key.lower() for key in ascii_uppercase}
+keyboard_backend = KeyboardBackend()
 
 
 class MacroError(Exception):
@@ -71,25 +49,23 @@ class MacroError(Exception):
 
 
 class Macro(object):
+    """ The data a macro needs for playback and dispatch. Editor widgets live in main.MacroRow. """
+
+    __slots__ = ('name', 'menu_keycode', 'activation_keycode', 'chat_opener_keycode', 'text', 'priority', 'actions', 'program', 'compiled_from', 'enabled', 'solo')
 
     name: str
     menu_keycode: int
     activation_keycode: int
+    chat_opener_keycode: int
     text: str
-    delays: dict[float, float]
+    priority: int
+    actions: Optional[list[str]]
+    program: Optional[Program]
+    compiled_from: Optional[tuple]  # what `program` was compiled from, see `source`
     enabled: bool
+    solo: bool
 
-    root: Optional[MainUI]
-    row: Optional[Frame]
-    menu_button: Optional[Button]
-    activation_button: Optional[Button]
-    chat_opener_button: Optional[Button]
-    text_string_var: Optional[StringVar]
-    delete_button: Optional[Button]
-
-    def __init__(self, macros: Macros, name: str = '', data: dict = {}) -> None:
-        logging.log(logging.INFO, f'Loading macro: {data}')
-        self._macros = macros
+    def __init__(self, name: str = '', data: dict = {}) -> None:
         self.name = name
         self.menu_keycode = data.get('menu_keycode', -1)
         self.activation_keycode = data.get('activation_keycode', -1)
@@ -99,76 +75,72 @@ class Macro(object):
         self.solo = self.menu_keycode is None
 
         self.text = data.get('text', None)
+        self.priority = data.get('priority', 0)
+        self.actions = data.get('actions', None)
+        self.program = None
+        self.compiled_from = None
 
         self.enabled = self.is_valid()
 
-        self.root = None
-        self.row = None
-        self.menu_button = None
-        self.activation_button = None
-        self.chat_opener_button = None
-        self.text_string_var = None
-        self.delete_button = None
-
     def refresh_enabled(self) -> None:
         self.enabled = self.is_valid()
-        logging.log(logging.INFO, f'Macro: {self.name} is enabled: {self.enabled}')
+        if self.enabled and self.compiled_from != self.source():
+            try:
+                self.compile()
+            except ActionError as e:
+                logging.log(logging.WARNING, f'Macro: {self.name} has bad actions: {e}')
+                self.enabled = False
 
     def is_valid(self):
         return self.activation_keycode != -1 and self.text is not None and self.text != ''
 
-    def play(self) -> None:
+    def check_keycodes(self) -> list[str]:
+        """ Tags legacy virtual-key codes and returns a message for every code we can't name. """
+        self.menu_keycode = normalize_code(self.menu_keycode)
+        self.activation_keycode = normalize_code(self.activation_keycode)
+        self.chat_opener_keycode = normalize_code(self.chat_opener_keycode)
+
+        errors = []
+        for field in ('menu_keycode', 'activation_keycode', 'chat_opener_keycode'):
+            code = getattr(self, field)
+            if not is_valid_code(code):
+                errors.append(f'macro {self.name!r}: unknown {field} {code}')
+        if self.chat_opener_keycode > 0 and self.chat_opener_keycode & VK_FLAG:
+            errors.append(f'macro {self.name!r}: chat_opener_keycode must be a scan code, not a virtual-key code')
+        return errors
+
+    def play(self, backend=None) -> None:
+        """ Plays the macro through `backend`, the real keyboard by default. """
         if not self.enabled:
             return
         logging.log(logging.INFO, f'Playing macro: {self.name}')
-        if self.chat_opener_keycode:
-            press(self.chat_opener_keycode)
-            release(self.chat_opener_keycode)
-            sleep(0.05)  # TODO: Make this configurable
-
-        speed: float = 0  # TODO: Make this configurable
-
-        if not speed:
-            for key in self.text:
+        if self.program is None:
+            self.compile()
+        backend = backend or keyboard_backend
+        metrics.injected_events.inc(run(self.program, backend.press, backend.release, backend.write, backend.sleep))  # type: ignore
 
-                if key in to_shift:
-                    key = to_shift[key]
-
-                    press('shift')
-                    press(key)
-                    release(key)
-                    release('shift')
-                else:
-                    press(key)
-                    release(key)
-                sleep(0.0001)
-            press('enter')
-            release('enter')
+    async def play_async(self, backend=None) -> None:
+        """ Plays the macro on the engine loop. Cancelling it releases any keys it was holding. """
+        if not self.enabled:
             return
-
-        for key in self.text:
-            if key in to_shift:
-                key = to_shift[key]
-
-                press('shift')
-                press(key)
-
-                sleep(speed)
-
-                release(key)
-                release('shift')
-
-                sleep(speed)
-            else:
-                press(key)
-
-                sleep(speed)
-
-                release(key)
-
-                sleep(speed)
-            press('enter')
-            release('enter')
+        logging.log(logging.INFO, f'Playing macro: {self.name}')
+        if self.program is None:
+            self.compile()
+        backend = backend or keyboard_backend
+        metrics.injected_events.inc(await run_async(self.program, backend.press, backend.release, backend.write, backend.wait))  # type: ignore
+
+    def source(self) -> tuple:
+        """ Everything the compiled program depends on. """
+        return (self.text, tuple(self.actions) if self.actions else None, self.chat_opener_keycode)
+
+    def compile(self) -> None:
+        """ Compiles the macro's actions, or just saying its text if it has none. """
+        source = self.source()
+        if self.actions:
+            self.program = compile_actions(self.actions, self.chat_opener_keycode)
+        else:
+            self.program = compile_say(self.text or '', self.chat_opener_keycode)
+        self.compiled_from = source
 
     def to_dict(self) -> Optional[dict]:
         if not self.is_valid():
@@ -182,6 +154,10 @@ class Macro(object):
             out['menu_keycode'] = self.menu_keycode
         if self.chat_opener_keycode:
             out['chat_opener_keycode'] = self.chat_opener_keycode
+        if self.priority:
+            out['priority'] = self.priority
+        if self.actions:
+            out['actions'] = list(self.actions)
 
         return out
 
@@ -191,196 +167,295 @@ class Macro(object):
     def __repr__(self) -> str:
         return f'Macro: {self.name}'
 
-    def configure_tk(self, root: MainUI, row: Frame, menu_button: Button, activation_button: Button, chat_opener_button: Button, text_string_var: StringVar, delete_button: Button) -> None:
-        self.root = root
-        self.row = row
-        self.menu_button = menu_button
-        self.activation_button = activation_button
-        self.chat_opener_button = chat_opener_button
-        self.text_string_var = text_string_var
-        self.delete_button = delete_button
-
-        self.menu_button.configure(text=get_keyname(
-            self.menu_keycode) if self.menu_keycode != -1 else '', command=self.set_menu_keycode)
-        self.activation_button.configure(text=get_keyname(
-            self.activation_keycode), command=self.set_activation_keycode)
-        self.chat_opener_button.configure(text=get_keyname(
-            self.chat_opener_keycode), command=self.set_chat_opener_keycode)
-        self.text_string_var.set(self.text)
-        self.text_string_var.trace("w", self.set_text)
-        self.delete_button.configure(
-            command=lambda self=self: root.delete_macro(self))
-
-    def set_menu_keycode(self) -> None:
-        """ Sets the menu keycode for the macro by waiting for a keypress. """
-        assert self.root is not None
-        assert self.menu_button is not None
-        assert self.activation_button is not None
-
-        old_menu = self.menu_keycode
-        old_activation = self.activation_keycode
-        # old = self.menu_button.cget('text')
-        self.menu_button.configure(text='...')
-        self.root.update()
-
-        scan_code = None
-        while scan_code is None:
-            scan_code = read_event(suppress=True).scan_code
-            logging.log(logging.INFO, f'Key Pressed! {scan_code}')
-
-            if scan_code not in scancode_to_keyname:
-                scan_code = None
-                continue
-
-            code, message = self._macros.verify_key_combo(
-                scan_code, self.activation_keycode)
-            if code != 0:
-                self.activation_keycode = -1
-                self.activation_button.configure(
-                    text=get_keyname(self.activation_keycode))
-                # self.root.show_error(message)
-
-        if scan_code == 1:  # Esc
-            self.menu_keycode = -1
-            self.menu_button.configure(text='')
-        else:
-            self.menu_keycode = scan_code
-            self.menu_button.configure(text=get_keyname(self.menu_keycode))
-
-        self._macros.update_macro(old_menu, old_activation, self)
-
-    def set_activation_keycode(self) -> None:
-        """ Sets the activation keycode for the macro by waiting for a keypress. """
-        assert self.root is not None
-        assert self.activation_button is not None
-        assert self.menu_button is not None
-
-        old_menu = self.menu_keycode
-        old_activation = self.activation_keycode
-        self.activation_button.configure(text='...')
-        self.root.update()
-
-        scan_code = None
-        while scan_code is None:
-            scan_code = read_event(suppress=True).scan_code
-            logging.log(logging.INFO, f'Key Pressed! {scan_code}')
-            if scan_code not in scancode_to_keyname:
-                scan_code = None
-                continue
-
-            code, message = self._macros.verify_key_combo(
-                self.menu_keycode, scan_code)
-            if code != 0:
-                self.menu_keycode = -1
-                self.menu_button.configure(text=get_keyname(self.menu_keycode))
-                # self.root.show_error(message)
-
-        self.activation_keycode = scan_code
-        self.activation_button.configure(
-            text=get_keyname(self.activation_keycode))
-        self._macros.update_macro(old_menu, old_activation, self)
-
-    def set_chat_opener_keycode(self) -> None:
-        """ Sets the chat opener keycode for the macro by waiting for a keypress. """
-        assert self.root is not None
-        assert self.chat_opener_button is not None
-
-        self.chat_opener_button.configure(text='...')
-        self.root.update()
-
-        scan_code = None
-        while scan_code is None:
-            scan_code = read_event(suppress=True).scan_code
-            logging.log(logging.INFO, f'Key Pressed! {scan_code}')
-            if scan_code not in scancode_to_keyname:
-                scan_code = None
-
-        self.chat_opener_keycode = scan_code
-        self.chat_opener_button.configure(
-            text=get_keyname(self.chat_opener_keycode))
-
-    def set_text(self, name, index, mode) -> None:
-        """ Sets the text for the macro. """
-        assert self.text_string_var is not None
-
-        self.text = self.text_string_var.get()
-        self.name = self.text
 
+class MacroSnapshot:
+    """
+        Which macro each key combination plays, as of one published version of a Macros. Never
+        changed once published: Macros builds a new one after every change or batch and swaps
+        it in with a single assignment, so the hook thread reads it without a lock and never
+        sees half an edit. Unchanged menus are shared with the previous snapshot.
 
-class Macros:
+        Only the key combinations are frozen: the Macro objects are the ones Macros holds, and
+        the editor changes their text in place. The engine is paused while the editor is open,
+        so nothing plays a macro while it is being edited.
+    """
 
-    def __init__(self, filename: Optional[str]) -> None:
-        self.menus: dict[int, dict[int, Macro]] = {}
-        _menus: set[int] = set(self.menus.keys())
-        
+    __slots__ = ('menus', 'version')
 
-        if not filename:
-            return
+    def __init__(self, menus: dict[int, dict[int, Macro]], version: int = 0) -> None:
+        self.menus = menus
+        self.version = version
 
-        for macro_name, macro_data in load(filename).items():
-            macro = Macro(self, macro_name, macro_data)
+    def get_macro(self, menu_keycode: Optional[int], activation_keycode: Optional[int]) -> Optional[Macro]:
+        menu = self.menus.get(menu_keycode or -1)
+        return menu.get(activation_keycode or -1) if menu is not None else None
 
-            if macro.activation_keycode in _menus and macro.menu_keycode == -1:
-                raise ValueError(
-                    f'Activation keycode {macro.activation_keycode} is already in use by another macro.')
+    def scan_codes(self) -> set[int]:
+        """ Returns a set of all scan codes used by any macro. """
+        scan_codes = set(self.menus)
+        for menu in self.menus.values():
+            scan_codes.update(menu)
+        scan_codes.discard(-1)
+        return scan_codes
+
+
+class Batch:
+    """ The edits of one Macros.batch(): how to undo them, and what to announce at commit. """
+
+    __slots__ = ('undo', 'changes', 'inserted', 'replaced')
+
+    def __init__(self) -> None:
+        self.undo: list[tuple] = []  # ('put', menu, key, previous or None) | ('menu', menu) | ('keys', macro, menu, key)
+        self.changes: list[tuple[str, Macro]] = []
+        self.inserted: list[Macro] = []
+        self.replaced: list[tuple[Macro, Macro]] = []  # (pushed out, by)
+
+
+class Macros:
+
+    def __init__(self, filename: Optional[str], rate_limit: tuple[int, float] = (3, 2.0), data: Optional[dict] = None) -> None:
+        self.menus: dict[int, dict[int, Macro]] = {}  # the writers' copy, the hook thread reads `snapshot`
+        self.snapshot = MacroSnapshot({})
+        self.dirty: set[int] = set()  # menus changed since the last snapshot
+        self.scheduler = ChatScheduler(*rate_limit)
+        self.listeners: list[Callable[[list[tuple[str, Macro]]], None]] = []
+        self.journal: Optional[Journal] = None
+        self.pending: Optional[Batch] = None
+        self.changes = 0
+        self.saved_changes = 0
+
+        records = 0
+        from_file = data is None
+        if data is None:
+            if not filename:
+                return
+            data, records = replay(filename, load(filename))
+
+        errors: list[str] = []
+        loaded: list[tuple[Macro, str]] = []
+        for macro_name, macro_data in data.items():
+            macro = Macro(macro_name, macro_data)
+            errors.extend(macro.check_keycodes())
+            try:
+                macro.compile()
+            except ActionError as e:
+                errors.extend(f'macro {macro_name!r}: {error}' for error in e.errors)
+            loaded.append((macro, f'macro {macro_name!r}'))
+
+        errors.extend(find_conflicts(loaded))
+        if errors:
+            raise ConfigError(filename or 'config', errors)
+
+        with self.batch():
+            for macro, _ in loaded:
+                self.insert_macro(macro)
+        self.arm_macros()  # everything compiled above, so this only sets `enabled`
+        self.saved_changes = self.changes
+
+        if from_file and filename:
+            self.journal = Journal(filename, records)
+            self.journal.attach(self)
 
-            self.insert_macro(macro)
-        
-        self.last_yaml = self.to_yaml()
-    
 
     def arm_macros(self) -> None:
         """ Arms all valid macros. """
+        armed = total = 0
         for menu in self.menus.values():
             for macro in menu.values():
                 macro.refresh_enabled()
+                armed += macro.enabled
+                total += 1
+        logging.log(logging.INFO, f'Armed {armed} of {total} macros')
 
 
     def has_changed(self) -> bool:
-        try:
-            return self.last_yaml != self.to_yaml()
-        except Exception:
-            return True
+        return self.changes != self.saved_changes
+
+    def save(self, filename: str, force: bool = False) -> None:
+        """
+            Makes the macros durable in `filename`. When they were loaded from that file every
+            change is already journaled, so this only syncs the journal and compacts it in the
+            background. Otherwise the file is written in full and a journal started for it.
+            Until then the edits can be dropped again with `discard`.
+        """
+        if self.journal and self.journal.filename == filename:
+            self.journal.sync()
+            self.journal.compact()
+        else:
+            text = self.to_text(filename, force)
+            with open(filename, 'w', encoding='utf-8') as f:
+                f.write(text)
+            if self.journal:
+                # The edits are saved in the new file, not in the one they were journaled for
+                self.journal.discard()
+                self.journal.detach()
+            self.journal = Journal(filename)
+            self.journal.attach(self)
+        self.saved_changes = self.changes
     
 
+    def discard(self) -> None:
+        """ Forgets the journaled edits made since the last save. Call it when these macros are being thrown away. """
+        if self.journal:
+            self.journal.discard()
+        self.saved_changes = self.changes
+
     def get_unique_scan_codes(self) -> set[int]:
         """ Returns a set of all scan codes used by any macro. """
-        scan_codes = set()
-        scan_codes.update(self.menus.keys())
-        for menu in self.menus.values():
-            scan_codes.update(menu.keys())
-        scan_codes.discard(-1)
-        return scan_codes
+        return self.snapshot.scan_codes()
 
-    def verify_key_combo(self, menu_keycode: int, activation_keycode: int) -> tuple[int, str]:
-        """ Check if any of the macros share any invalid keycodes. 
+    def verify_key_combo(self, menu_keycode: int, activation_keycode: int, macro: Optional[Macro] = None) -> tuple[int, str]:
+        """ Checks whether `macro` (or a new macro) can take these keys. These are the conflicts
+        find_conflicts refuses at load, so the editor never saves a config that can't be loaded.
 
         Returns:
             0: No errors
-            1: Activation keycode is already in use by another macro
-            2: Activation keycode is occupied by an existing menu
+            1: The key combination is already in use by another macro
+            2: The solo key is occupied by an existing menu
+            3: The menu key is another macro's solo key, which would never fire
         """
-        menu = self.menus.get(menu_keycode, {})
-        if activation_keycode in menu:
-            return 1, f'Activation keycode {activation_keycode} is already in use by another macro.'
+        other = self.menus.get(menu_keycode, {}).get(activation_keycode)
+        if other is not None and other is not macro:
+            return 1, f'{describe(menu_keycode, activation_keycode)} is already used by macro {other.name!r}.'
+
+        if menu_keycode == -1 and activation_keycode != -1 and \
+                any(item is not macro for item in self.menus.get(activation_keycode, {}).values()):
+            return 2, f'{get_keyname(activation_keycode)} opens a menu, so it can\'t also be a solo key.'
 
-        if menu_keycode == -1 and activation_keycode in self.menus:
-            return 2, f'Activation keycode {activation_keycode} is occupied by an existing menu.'
+        solo = self.menus.get(-1, {}).get(menu_keycode) if menu_keycode != -1 else None
+        if solo is not None and solo is not macro:
+            return 3, f'{get_keyname(menu_keycode)} is the solo key of macro {solo.name!r}, which would never fire.'
 
         return 0, ''
 
+    def subscribe(self, listener: Callable[[list[tuple[str, Macro]]], None]) -> None:
+        """ Calls `listener` with a list of ('insert' | 'update' | 'remove', macro) after every change. """
+        self.listeners.append(listener)
+
+    def unsubscribe(self, listener: Callable[[list[tuple[str, Macro]]], None]) -> None:
+        if listener in self.listeners:
+            self.listeners.remove(listener)
+
+    def notify(self, changes: list[tuple[str, Macro]]) -> None:
+        if self.pending is not None:
+            self.pending.changes.extend(changes)
+            return
+        self.publish()
+        self.changes += 1
+        for listener in self.listeners:
+            listener(changes)
+
+    def publish(self) -> None:
+        """ Swaps in a snapshot with the changed menus copied, sharing the rest with the current one. """
+        if not self.dirty:
+            return
+        menus = dict(self.snapshot.menus)
+        for keycode in self.dirty:
+            menu = self.menus.get(keycode)
+            if menu is None:
+                menus.pop(keycode, None)
+            else:
+                menus[keycode] = dict(menu)
+        self.dirty.clear()
+        self.snapshot = MacroSnapshot(menus, self.snapshot.version + 1)
+
+    @contextmanager
+    def batch(self) -> Iterator[Macros]:
+        """
+            Applies the inserts, updates and removals made inside it as one transaction. Listeners
+            hear about them once, at commit, and the edits are logged as one summary. If the block
+            raises, or an edit took a key combination another macro was using or left a solo key
+            shadowed by a menu, every edit is undone and the error (a ConfigError for conflicts)
+            propagates. Batches inside a batch are part of it.
+        """
+        if self.pending is not None:
+            yield self
+            return
+
+        batch = self.pending = Batch()
+        try:
+            yield self
+            errors = self.check_batch(batch)
+            if errors:
+                raise ConfigError('batch', errors)
+        except BaseException:
+            self.pending = None
+            self.rollback(batch)
+            self.dirty.clear()  # back to what the current snapshot already shows
+            logging.log(logging.INFO, f'Rolled back a batch of {len(batch.changes)} changes')
+            raise
+
+        self.pending = None
+        if batch.changes:
+            counts: dict[str, int] = {}
+            for kind, _ in batch.changes:
+                counts[kind] = counts.get(kind, 0) + 1
+            logging.log(logging.INFO, 'Committed a batch: ' + ', '.join(f'{count} {kind}' for kind, count in counts.items()))
+            self.notify(batch.changes)
+
+    def check_batch(self, batch: Batch) -> list[str]:
+        """ The conflicts a batch's edits made. Only looks at the macros it touched. """
+        errors = []
+        for old, new in batch.replaced:
+            if self.get_menu(old.menu_keycode) is None or self.menus[old.menu_keycode].get(old.activation_keycode) is not old:
+                errors.append(f'macro {new.name!r}: {describe(new.menu_keycode, new.activation_keycode)} is already used by macro {old.name!r}')
+
+        solos = self.menus.get(-1, {})
+        for macro in batch.inserted:
+            menu, key = macro.menu_keycode, macro.activation_keycode
+            if self.menus.get(menu, {}).get(key) is not macro:
+                continue  # removed or moved again later in the batch
+            if menu == -1 and key != -1 and self.menus.get(key):
+                errors.append(f'macro {macro.name!r}: solo key {get_keyname(key)} never fires, it opens a menu')
+            elif menu != -1 and menu in solos:
+                errors.append(f'macro {solos[menu].name!r}: solo key {get_keyname(menu)} never fires, macro {macro.name!r} makes it open a menu')
+        return errors
+
+    def rollback(self, batch: Batch) -> None:
+        for entry in reversed(batch.undo):
+            if entry[0] == 'put':
+                _, menu, key, previous = entry
+                if previous is None:
+                    self.menus[menu].pop(key, None)
+                else:
+                    self.menus[menu][key] = previous
+            elif entry[0] == 'menu':
+                self.menus.pop(entry[1], None)
+            else:
+                _, macro, menu, key = entry
+                macro.menu_keycode = menu
+                macro.activation_keycode = key
+
     def insert_macro(self, macro: Macro) -> None:
-        logging.log(logging.INFO, f'Loading macro {macro.name}')
-        if macro.menu_keycode not in self.menus:
-            logging.log(logging.INFO, 'Creating menu')
-            self.menus[macro.menu_keycode] = {}
+        self.dirty.add(macro.menu_keycode)
+        menu = self.menus.get(macro.menu_keycode)
+        if menu is None:
+            menu = self.menus[macro.menu_keycode] = {}
+            if self.pending is not None:
+                self.pending.undo.append(('menu', macro.menu_keycode))
+
+        replaced = menu.get(macro.activation_keycode)
+        menu[macro.activation_keycode] = macro
+        if self.pending is not None:
+            self.pending.undo.append(('put', macro.menu_keycode, macro.activation_keycode, replaced))
+            self.pending.inserted.append(macro)
+        else:
+            logging.log(logging.INFO, f'Inserting macro {macro.name} at {describe(macro.menu_keycode, macro.activation_keycode)}')
 
-        logging.log(logging.INFO, 
-            f'Inserting macro {macro.name} into menu {macro.menu_keycode} with activation keycode {macro.activation_keycode}')
-        self.menus[macro.menu_keycode][macro.activation_keycode] = macro
+        if replaced is not None and replaced is not macro:
+            if self.pending is not None:
+                self.pending.replaced.append((replaced, macro))
+            self.notify([('remove', replaced), ('insert', macro)])
+        else:
+            self.notify([('insert', macro)])
 
     def update_macro(self, old_menu: int, old_active: int, macro: Macro) -> None:
+        """ Moves a macro whose keys were changed from (old_menu, old_active) to its new keys. """
         del self.menus[old_menu][old_active]
+        self.dirty.add(old_menu)
+        if self.pending is not None:
+            self.pending.undo.append(('put', old_menu, old_active, macro))
+            self.pending.undo.append(('keys', macro, old_menu, old_active))
         self.insert_macro(macro)
 
     def get_macro(self, menu_keycode: Optional[int], activation_keycode: Optional[int]) -> Optional[Macro]:
@@ -393,6 +468,10 @@ class Macros:
 
     def remove_macro(self, macro: Macro) -> None:
         del self.menus[macro.menu_keycode][macro.activation_keycode]
+        self.dirty.add(macro.menu_keycode)
+        if self.pending is not None:
+            self.pending.undo.append(('put', macro.menu_keycode, macro.activation_keycode, macro))
+        self.notify([('remove', macro)])
 
     def add_macro(
         self,
@@ -401,9 +480,7 @@ class Macros:
         chat_opener_keycode: Optional[int] = 20,
         text: str = 'What a save!'
     ) -> Macro:
-        logging.log(logging.INFO, 
-            f'Adding macro with menu keycode {menu_keycode}, activation keycode {activation_keycode}, chat opener keycode {chat_opener_keycode}, and text {text}')
-        macro = Macro(self, text, {
+        macro = Macro(text, {
             'menu_keycode': menu_keycode or -1,
             'activation_keycode': activation_keycode or -1,
             'chat_opener_keycode': chat_opener_keycode or -1,
@@ -433,22 +510,33 @@ class Macros:
             out.append(macro)
         return out
 
+    def to_data(self, force=False) -> dict[str, dict]:
+        """ Returns the valid macros as a plain dict in the same shape the loader produces. """
+        out = {}
+        incomplete: list[Macro] = []
+        for macro in self.get_all():
+            mdict = macro.to_dict()
+            if mdict:
+                if macro.name in out:
+                    macro.name = f'{macro.name} ({macro.activation_keycode})'
+                out[macro.name] = mdict
+            elif not force:
+                incomplete.append(macro)
+
+        if incomplete and not force:
+            raise MacroError(incomplete)
+
+        return out
+
+    def to_text(self, filename: str, force=False) -> str:
+        """ Serializes the macros in the format matching `filename`'s extension. """
+        try:
+            return dumps(self.to_data(force), filename)
+        except (YAMLSerializationError, YAMLValidationError, MarkedYAMLError):
+            return ''
+
     def to_yaml(self, force=False) -> str:
         try:
-            out = {}
-            incomplete: list[Macro] = []
-            for macro in self.get_all():
-                mdict = macro.to_dict()
-                if mdict:
-                    if macro.name in out:
-                        macro.name = f'{macro.name} ({macro.activation_keycode})'
-                    out[macro.name] = mdict
-                elif not force:
-                    incomplete.append(macro)
-
-            if incomplete and not force:
-                raise MacroError(incomplete)
-
-            return dump(out)
+            return dump(self.to_data(force))
         except (YAMLSerializationError, YAMLValidationError, MarkedYAMLError):
             return ''
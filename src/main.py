@@ -22,15 +22,30 @@
 
 
 from datetime import datetime
-from tkinter import DISABLED, HORIZONTAL, Button, Entry, Frame, Label, Scale, StringVar, Tk, filedialog
-from tkinter import messagebox
+from tkinter import DISABLED, HORIZONTAL, Button, Canvas, Entry, Frame, Label, Scale, StringVar, Tk, Toplevel, filedialog
+from tkinter import messagebox, simpledialog
 from tkinter.font import Font
 import traceback
 from typing import Optional
 from macros import Macros, Macro, MacroError, get_keyname
+from loader import ConfigError, config_extensions, yaml_extensions, json_extensions
+from store import ProfileStore, profile_name
+from search import MacroIndex
+from keycodes import scancode_to_keyname
+from profiling import Profiler
+from engine import Engine
+from core import core
+from backends import KeyboardBackend
+from keytrace import TraceRecorder
+from split import RemoteEngine
+from latency import latency, parse_cpus
+import control
+import metrics
+from threading import Thread
+import argparse
 import os
 import sys
-from keyboard import hook, KeyboardEvent
+from keyboard import add_hotkey, read_event
 import logging
 
 def try_make_dir(path: str):
@@ -72,8 +87,13 @@ for file in os.listdir(pathify('logs')):
         os.remove(file)
 
 
+profiler = Profiler(pathify('logs'))
+profile_hotkey = 'ctrl+alt+p'
 
-overlay = False
+split_engine = False  # run the hook and playback in a separate process, see split.py
+backend_class = KeyboardBackend
+suppress_keys = False  # keep the keys EMacros uses from reaching the game
+metrics_port: Optional[int] = None  # with split_engine the engine process serves the metrics
 
 logging.log(logging.INFO, 'Starting up...')
 
@@ -86,22 +106,125 @@ logging.log(logging.INFO, f'Checking for configs in {configs_dir}...')
 # find the last opened config file
 configs = []
 for file in os.listdir(configs_dir):
-    if file.endswith('.yml') or file.endswith('.yaml'):
+    if file.endswith(config_extensions):
         config = os.path.join(configs_dir, file)
         atime = os.stat(config).st_atime
         configs.append((config, atime))
 
 configs.sort(key=lambda x: x[1], reverse=True)
 
+config_filetypes = [('YAML', yaml_extensions), ('JSON', json_extensions)]
+
+store_filename = pathify('profiles.db')
+store = ProfileStore(store_filename)
+store.sync(configs_dir)
+
+
+class MacroRow:
+    """ The editor widgets for one macro. Owned by MainUI and thrown away with the table. """
+
+    def __init__(self, root: 'MainUI', macro: Macro, row: Frame, menu_button: Button, activation_button: Button, chat_opener_button: Button, text_string_var: StringVar, delete_button: Button) -> None:
+        self.root = root
+        self.macros = root.macros
+        self.macro = macro
+        self.row = row
+        self.menu_button = menu_button
+        self.activation_button = activation_button
+        self.chat_opener_button = chat_opener_button
+        self.text_string_var = text_string_var
+        self.delete_button = delete_button
+
+        self.menu_button.configure(text=get_keyname(
+            macro.menu_keycode) if macro.menu_keycode != -1 else '', command=self.set_menu_keycode)
+        self.activation_button.configure(text=get_keyname(
+            macro.activation_keycode), command=self.set_activation_keycode)
+        self.chat_opener_button.configure(text=get_keyname(
+            macro.chat_opener_keycode), command=self.set_chat_opener_keycode)
+        self.text_string_var.set(macro.text)
+        self.trace = self.text_string_var.trace_add('write', self.set_text)
+        self.delete_button.configure(
+            command=lambda macro=macro: root.delete_macro(macro))
+
+    def destroy(self) -> None:
+        self.text_string_var.trace_remove('write', self.trace)
+        self.row.destroy()
+
+    def read_scan_code(self) -> int:
+        """ Waits for a keypress we have a name for. """
+        scan_code = None
+        while scan_code is None:
+            scan_code = read_event(suppress=True).scan_code
+            logging.log(logging.INFO, f'Key Pressed! {scan_code}')
+            if scan_code not in scancode_to_keyname:
+                scan_code = None
+        return scan_code
+
+    def set_menu_keycode(self) -> None:
+        """ Sets the menu keycode for the macro by waiting for a keypress. Esc clears it. """
+        macro = self.macro
+        old_menu = macro.menu_keycode
+        old_activation = macro.activation_keycode
+        self.menu_button.configure(text='...')
+        self.root.update()
+
+        scan_code = self.read_scan_code()
+        menu_keycode = -1 if scan_code == 1 else scan_code  # Esc
+        code, message = self.macros.verify_key_combo(menu_keycode, macro.activation_keycode, macro)
+        if code != 0:
+            self.menu_button.configure(text=get_keyname(old_menu) if old_menu != -1 else '')
+            messagebox.showerror('Key already taken!', message, parent=self.root)
+            return
 
-class MainUI(Tk):
-    def __init__(self, macros: Optional[Macros], config_filename: Optional[str] = None):
-        super().__init__()
+        macro.menu_keycode = menu_keycode
+        self.menu_button.configure(text=get_keyname(menu_keycode) if menu_keycode != -1 else '')
+        self.macros.update_macro(old_menu, old_activation, macro)
+
+    def set_activation_keycode(self) -> None:
+        """ Sets the activation keycode for the macro by waiting for a keypress. """
+        macro = self.macro
+        old_menu = macro.menu_keycode
+        old_activation = macro.activation_keycode
+        self.activation_button.configure(text='...')
+        self.root.update()
+
+        scan_code = self.read_scan_code()
+        code, message = self.macros.verify_key_combo(macro.menu_keycode, scan_code, macro)
+        if code != 0:
+            self.activation_button.configure(text=get_keyname(old_activation))
+            messagebox.showerror('Key already taken!', message, parent=self.root)
+            return
+
+        macro.activation_keycode = scan_code
+        self.activation_button.configure(
+            text=get_keyname(macro.activation_keycode))
+        self.macros.update_macro(old_menu, old_activation, macro)
+
+    def set_chat_opener_keycode(self) -> None:
+        """ Sets the chat opener keycode for the macro by waiting for a keypress. """
+        self.chat_opener_button.configure(text='...')
+        self.root.update()
+
+        self.macro.chat_opener_keycode = self.read_scan_code()
+        self.chat_opener_button.configure(
+            text=get_keyname(self.macro.chat_opener_keycode))
+        self.macros.notify([('update', self.macro)])
+
+    def set_text(self, *args) -> None:
+        """ Sets the text for the macro. """
+        self.macro.text = self.text_string_var.get()
+        self.macro.name = self.macro.text
+        self.macros.notify([('update', self.macro)])
+
+
+class MainUI(Toplevel):
+    def __init__(self, app: 'App', macros: Optional[Macros], config_filename: Optional[str] = None):
+        super().__init__(app)
 
         self.config_filename = config_filename
         self.macros = macros  # type: ignore
 
         self.table = None
+        self.rows: list[MacroRow] = []
         if not self.macros:
             _configs = configs.copy()
             logging.log(logging.INFO, f'No config file found, trying to load from {_configs}')
@@ -118,6 +241,8 @@ class MainUI(Tk):
                 self.macros = Macros(self.config_filename)
 
         self.macros: Macros
+        self.index = MacroIndex(self.macros)
+        self.query = StringVar(self, '')
         self.menu_frame = None
 
         self.macros_per_page = 9
@@ -143,9 +268,20 @@ class MainUI(Tk):
         self.populate()
 
     def calculate_pages(self):
-        self.pages = (len(self.macros.get_all()) //
+        self.pages = (len(self.visible_macros()) //
                       self.macros_per_page + 1) if self.macros else 1
 
+    def visible_macros(self) -> list[Macro]:
+        """ All macros, or only the ones matching the search box. """
+        query = self.query.get()
+        if not query.strip():
+            return self.macros.get_all()
+        return self.index.search(query)
+
+    def search(self, *args):
+        self.page = 0
+        self.refresh_table()
+
     def populate(self):
         self.bind('<Expose>', self.maximize)
         self.bind_all('<Button>', lambda e: e.widget.focus_set())
@@ -209,6 +345,12 @@ class MainUI(Tk):
                                 y=3, width=width, height=height)
         self.close_button.bind('<ButtonPress-1>', self.exit)
 
+        # Search box, lives outside the table so it keeps focus while the table is rebuilt
+        self.search_entry = Entry(self, textvariable=self.query, bg='#222222', fg='white',
+                                  insertbackground='#00ffee', font=self.usual_font(12), border=0)
+        self.search_entry.place(x=5, y=self.height - 35, width=135, height=30)
+        self.query.trace_add('write', self.search)
+
         for widget in moveable:
             widget.bind('<ButtonPress-1>', self.startMove)
             widget.bind('<ButtonRelease-1>', self.stopMove)
@@ -222,6 +364,10 @@ class MainUI(Tk):
     def refresh_table(self):
         self.calculate_pages()
 
+        for row in self.rows:
+            row.destroy()
+        self.rows.clear()
+
         if self.table:
             self.table.destroy()
             self.table = None
@@ -257,6 +403,7 @@ class MainUI(Tk):
             self.table = Frame(self, bg='black', border=0)
             self.table.place(x=0, y=45, width=self.width,
                              height=self.height - 40)
+            self.search_entry.lift()
         # make self.table overflow and scroll
 
         # Create a row with 3 buttons, a text box, and a button.
@@ -281,14 +428,24 @@ class MainUI(Tk):
         menubindlabel.place(x=5, y=0, width=80, height=height)
         activationbindlabel.place(x=90, y=0, width=80, height=height)
         chatbindlabel.place(x=175, y=0, width=80, height=height)
-        textlabel.place(x=245, y=0, width=300, height=height)
+        textlabel.place(x=245, y=0, width=200, height=height)
         self.addmacrobutton.place(x=695, y=-3, width=40, height=height)
 
+        hotkey = store.get_hotkey(profile_name(self.config_filename)) if self.config_filename else None
+        self.profile_key_button = Button(row, text=f'Profile: {get_keyname(hotkey, "")}', bg='black', fg='white', font=self.usual_font(12), border=0,
+                                         activebackground='black', activeforeground='white', command=self.set_profile_hotkey)
+        self.profile_key_button.place(x=550, y=0, width=140, height=height)
+
+        capacity, window = store.get_rate_limit(profile_name(self.config_filename)) if self.config_filename else (3, 2.0)
+        self.rate_limit_button = Button(row, text=f'Rate: {capacity}/{window:g}s', bg='black', fg='white', font=self.usual_font(12), border=0,
+                                        activebackground='black', activeforeground='white', command=self.set_rate_limit)
+        self.rate_limit_button.place(x=445, y=0, width=100, height=height)
+
         # put a divider under that row
         divider = Frame(self.table, bg='white', border=0)
         divider.place(x=0, y=40, width=self.width, height=1)
 
-        sorted_macros = self.macros.get_all(
+        sorted_macros = self.visible_macros(
         )[self.macros_per_page * page:self.macros_per_page * (page + 1)]
         logging.log(logging.INFO, f'{len(sorted_macros)} macros to insert')
         for macro in sorted_macros:
@@ -341,7 +498,7 @@ class MainUI(Tk):
         chatbind = Button(row, bg='black', fg='white',
                           font=self.usual_font(), border=0)
 
-        text = StringVar()
+        text = StringVar(self)
         entry = Entry(row, textvariable=text, bg='#222222', fg='white',
                       insertbackground='#00ffee', font=self.usual_font(), border=0)
         # entry.bind('<Return>', lambda _: entry.selection_clear())
@@ -355,17 +512,15 @@ class MainUI(Tk):
         entry.place(x=260, y=0, width=420, height=height)
         delete.place(x=700, y=0, width=30, height=height)
 
-        macro.configure_tk(self, row, menubind,
-                           activationbind, chatbind, text, delete)
+        self.rows.append(MacroRow(self, macro, row, menubind,
+                                  activationbind, chatbind, text, delete))
 
     def play(self, e=None):
-        global overlay
         self.macros.arm_macros()
         if self.macros.has_changed():
             if not self.save(e):
                 return
-        overlay = True
-        self.destroy()
+        self.master.show_overlay()
 
     def save(self, e=None) -> bool:
         logging.log(logging.INFO, self.config_filename)
@@ -375,84 +530,148 @@ class MainUI(Tk):
         if not self.macros.has_changed():
             return True
 
+        force = False
         try:
-            yaml = self.macros.to_yaml()
+            self.macros.to_data()
         except MacroError as e:
-            do_continue = messagebox.askquestion(e.title, e.body)
+            do_continue = messagebox.askquestion(e.title, e.body, parent=self)
             if do_continue == 'no':
                 return False
             else:
-                yaml = self.macros.to_yaml(force=True)
+                force = True
 
         do_continue = messagebox.askquestion(
-            'Save Macros?', 'Are you sure you want to save them?')
+            'Save Macros?', 'Are you sure you want to save them?', parent=self)
         if do_continue == 'no':
             return False
 
         try:
-            with open(self.config_filename, 'w') as f:
-                f.write(yaml)
-        except Exception as e:
+            self.macros.save(self.config_filename, force)
+        except Exception:
             messagebox.showerror('Error Saving Macros!',
-                                 traceback.format_exc())
+                                 traceback.format_exc(), parent=self)
             return False
 
         messagebox.showinfo(
-            'Saved!', 'Saved macros to ' + self.config_filename)
+            'Saved!', 'Saved macros to ' + self.config_filename, parent=self)
+        self.store_profile(self.config_filename)
         return True
 
     def save_as(self, e=None) -> bool:
 
+        force = False
         try:
-            yaml = self.macros.to_yaml()
+            self.macros.to_data()
         except MacroError as e:
-            do_continue = messagebox.askquestion(e.title, e.body)
+            do_continue = messagebox.askquestion(e.title, e.body, parent=self)
             if do_continue == 'no':
                 return False
             else:
-                yaml = self.macros.to_yaml(force=True)
+                force = True
         
         do_continue = messagebox.askquestion(
-            'Save Macros?', 'Are you sure you want to save them?')
+            'Save Macros?', 'Are you sure you want to save them?', parent=self)
         if do_continue == 'no':
             return False
 
         file = filedialog.asksaveasfilename(initialdir=os.path.dirname(self.config_filename) if self.config_filename else configs_dir, initialfile=os.path.basename(
-            self.config_filename) if self.config_filename else 'quickchats.yml', defaultextension='.yml', filetypes=[('YAML', '.yml')])
+            self.config_filename) if self.config_filename else 'quickchats.yml', defaultextension='.yml', filetypes=config_filetypes, parent=self)
         if not file:
             return False
 
         try:
-            with open(file, 'w') as f:
-                f.write(yaml)
-        except Exception as e:
+            self.macros.save(file, force)
+        except Exception:
             messagebox.showerror('Error Saving Macros!',
-                                 traceback.format_exc())
+                                 traceback.format_exc(), parent=self)
             return False
 
-        messagebox.showinfo('Saved!', 'Saved macros to ' + file)
+        messagebox.showinfo('Saved!', 'Saved macros to ' + file, parent=self)
         self.config_filename = file
+        self.store_profile(file)
         return True
 
     def load(self, e=None):
         filename = filedialog.askopenfilename(
-            defaultextension='.yml', filetypes=[('YAML', '.yml')])
-        if not filename:
+            defaultextension='.yml', filetypes=config_filetypes, parent=self)
+        if not filename or not self.keep_or_discard():
             return
 
         try:
-            with open(filename, 'r') as f:
-                macros = Macros(filename)
-        except Exception as e:
+            macros = Macros(filename)
+        except ConfigError as e:
+            messagebox.showerror('Error Loading Macros!', str(e), parent=self)
+            return
+        except Exception:
             messagebox.showerror('Error Loading Macros!',
-                                 traceback.format_exc())
+                                 traceback.format_exc(), parent=self)
             return
 
+        self.index.close()
         self.macros = macros
+        self.index = MacroIndex(macros)
         self.config_filename = filename
+        self.store_profile(filename)
 
         self.refresh_table()
 
+    def store_profile(self, filename: str):
+        try:
+            store.put(profile_name(filename), self.macros, filename)
+        except Exception:
+            logging.exception(f'Failed to store profile for {filename}')
+
+    def set_profile_hotkey(self):
+        """ Binds a key that switches the overlay to this profile. Esc unbinds it. """
+        if not self.config_filename:
+            messagebox.showinfo('Save first!', 'Save your macros before binding a profile key.', parent=self)
+            return
+
+        name = profile_name(self.config_filename)
+        if not store.get(name):
+            self.store_profile(self.config_filename)
+
+        self.profile_key_button.configure(text='Profile: ...')
+        self.update()
+
+        scan_code = read_event(suppress=True).scan_code
+        hotkey = None if scan_code == 1 else scan_code  # Esc
+        if hotkey is not None:
+            code, message = store.verify_hotkey(name, hotkey, self.macros)
+            if code != 0:
+                self.profile_key_button.configure(text=f'Profile: {get_keyname(store.get_hotkey(name), "")}')
+                messagebox.showerror('Key already taken!', message, parent=self)
+                return
+        store.set_hotkey(name, hotkey)
+        self.profile_key_button.configure(text=f'Profile: {get_keyname(hotkey, "")}')
+
+    def set_rate_limit(self):
+        """ Asks how many chat messages this profile may send per how many seconds, e.g. 3/2. """
+        if not self.config_filename:
+            messagebox.showinfo('Save first!', 'Save your macros before setting their rate limit.', parent=self)
+            return
+
+        name = profile_name(self.config_filename)
+        if not store.get(name):
+            self.store_profile(self.config_filename)
+
+        capacity, window = store.get_rate_limit(name)
+        answer = simpledialog.askstring('Rate Limit', 'Chat messages per seconds, e.g. 3/2:',
+                                        initialvalue=f'{capacity}/{window:g}', parent=self)
+        if not answer:
+            return
+        try:
+            messages, _, seconds = answer.partition('/')
+            capacity, window = int(messages), float(seconds)
+            if capacity < 1 or window <= 0:
+                raise ValueError(answer)
+        except ValueError:
+            messagebox.showerror('Invalid Rate Limit', f'{answer!r} is not messages/seconds, like 3/2.', parent=self)
+            return
+
+        store.set_rate_limit(name, capacity, window)
+        self.rate_limit_button.configure(text=f'Rate: {capacity}/{window:g}s')
+
     def minimize(self, e=None):
         self.overrideredirect(False)
         self.iconify()
@@ -486,23 +705,51 @@ class MainUI(Tk):
         self.geometry("+%s+%s" % (x, y))
 
     def exit(self, e=None):
-        self.destroy()
+        if self.keep_or_discard():
+            self.master.destroy()
 
+    def keep_or_discard(self) -> bool:
+        """
+            Asks whether to save unsaved edits before the macros are closed. Edits are journaled
+            as they are made, so declining has to drop them or the next load would bring them back.
+            Returns False if the user cancelled or saving failed.
+        """
+        if not self.macros.has_changed():
+            return True
+        answer = messagebox.askyesnocancel(
+            'Unsaved Changes', 'Save your changes first? No throws them away.', parent=self)
+        if answer is None:
+            return False
+        if answer:
+            return self.save()
+        self.macros.discard()
+        return True
 
-class Overlay(Tk):
+    def destroy(self):
+        # The macros outlive this window, so stop them notifying our index
+        self.index.close()
+        super().destroy()
 
-    menu_close_delay: float = 2.0
 
-    def __init__(self, macros: Optional[Macros]):
-        super().__init__()
+class Overlay(Toplevel):
 
-        self.macros = macros
-        self.unique_scan_codes = self.macros.get_unique_scan_codes() if self.macros else set()
-        self.stop_keyloop = lambda: None
-        self.down_keys = set()
-        self.start_keyloop()
+    def __init__(self, app: 'App'):
+        super().__init__(app)
 
-        self.menu_frame = None
+        # The engine and its hook belong to the app and outlive this window
+        self.engine = app.engine
+        self.shown_menu: tuple[Optional[int], Optional[Macros]] = (None, None)
+
+        self.menu_canvas = None
+        self.menu_items: list[tuple[int, int]] = []  # (key item, text item) per row, reused between opens
+        self.menu_fonts: dict[int, Font] = {}
+        self.menu_font_family = 'Helvetica'
+        self.min_font_size = 6
+        self.menu_rows: dict[tuple, list[tuple[str, str]]] = {}  # (menu keycode, macros) -> (key name, text) rows
+        self.menu_sizes: dict[tuple, int] = {}  # (menu keycode, macros) -> fitted size
+        self.text_widths: dict[tuple[str, int, str], int] = {}
+        self.line_heights: dict[int, int] = {}
+        self.drain_job = None
         self.width = 250
         self.height = 300
         self.w_offset = 0
@@ -523,48 +770,41 @@ class Overlay(Tk):
 
         self.populate()
 
-        self.current_menu: Optional[int] = None
-        self.menu_opened: Optional[datetime] = None
-        self.check_hide_menu()
+        self.drain_menu_events()
 
-    def key_handler(self, keycode):
-        if not self.current_menu and keycode in self.macros.menus:  # type: ignore
-            self.current_menu = keycode
-            self.menu_opened = datetime.now()
-            self.show_menu(keycode)
-        
-        elif self.current_menu and (macro := self.macros.get_macro(self.current_menu, keycode)):  # type: ignore
-            self.current_menu = None
-            self.hide_menu()
-            macro.play()
-        
-        elif not self.current_menu and (macro := self.macros.get_macro(None, keycode)):  # type: ignore
-            macro.play()
+    @property
+    def macros(self) -> Optional[Macros]:
+        return self.engine.macros
 
-    def start_keyloop(self):
-        self.stop_keyloop = hook(self.keyloop, suppress=False)
+    @property
+    def profile(self) -> Optional[str]:
+        return self.engine.profile
 
-    def keyloop(self, event: KeyboardEvent):
-        if event.scan_code not in self.unique_scan_codes:
-            logging.log(logging.INFO, f'Unknown key: {event.scan_code}')
-            return
+    def drain_menu_events(self):
+        self.apply_menu_events()
+        self.engine.expire()
+        self.drain_job = self.after(16, self.drain_menu_events)
 
-        logging.log(logging.INFO, f'Key {event.name}: {get_keyname(event.scan_code)} [{event.scan_code}]')
-        if event.event_type == 'down':
-            if event.scan_code in self.down_keys:
-                return
+    def apply_menu_events(self):
+        """
+            Applies the menu changes the engine queued since the last frame. Only the latest
+            one matters, so a burst of toggles costs at most one redraw.
+        """
+        events = self.engine.menu_events
+        if not events:
+            return
 
-            try:
-                self.down_keys.add(event.scan_code)
-            except KeyError:
-                pass
+        keycode = None
+        while events:
+            keycode = events.popleft()
 
-            self.key_handler(event.scan_code)
-        elif event.event_type == 'up':
-            try:
-                self.down_keys.remove(event.scan_code)
-            except KeyError:
-                pass
+        shown = (keycode, self.engine.macros)
+        if shown != self.shown_menu:
+            self.shown_menu = shown
+            if keycode is None:
+                self.hide_menu()
+            else:
+                self.show_menu(keycode)
 
     def populate(self):
 
@@ -612,6 +852,12 @@ class Overlay(Tk):
         self.opacity_slider.place(x=70, y=20, width=70, height=20)
         self.opacity_slider.bind('<B1-Motion>', self.change_opacity)
         self.opacity_slider.bind('<ButtonPress-1>', self.change_opacity)
+
+        # The menu is drawn as text items on one canvas, shown while a menu is open
+        self.menu_canvas = Canvas(self, bg='black', border=0, highlightthickness=0)
+        self.menu_canvas.bind('<ButtonPress-1>', self.startMove)
+        self.menu_canvas.bind('<ButtonRelease-1>', self.stopMove)
+        self.menu_canvas.bind('<B1-Motion>', self.moving)
     
 
     def change_opacity(self, event):
@@ -631,50 +877,96 @@ class Overlay(Tk):
 
         logging.log(logging.DEBUG, f"Showing menu for {keycode}")
 
-        if self.menu_frame:
-            self.menu_frame.destroy()
-
-        self.menu_frame = Frame(self, bg='black', border=0)
-        self.menu_frame.bind('<ButtonPress-1>', self.startMove)
-        self.menu_frame.bind('<ButtonRelease-1>', self.stopMove)
-        self.menu_frame.bind('<B1-Motion>', self.moving)
-        self.menu_frame.place(
+        canvas = self.menu_canvas
+        canvas.place(
             x=3, y=80, width=self.width + self.w_offset, height=self.height + self.h_offset -40)
 
+        rows = self.get_menu_rows(keycode)
+        size = self.fit_menu(keycode, rows)
+        font = self.menu_font(size)
+        line_height = self.line_height(size)
+
+        while len(self.menu_items) < len(rows):
+            self.menu_items.append((
+                canvas.create_text(0, 0, fill='white', anchor='nw'),
+                canvas.create_text(0, 0, fill='white', anchor='nw')
+            ))
+
+        for i, (key_item, text_item) in enumerate(self.menu_items):
+            if i >= len(rows):
+                canvas.itemconfigure(key_item, state='hidden')
+                canvas.itemconfigure(text_item, state='hidden')
+                continue
+
+            key_name, text = rows[i]
+            y = (line_height + 3) * i
+            canvas.coords(key_item, 0, y)
+            canvas.itemconfigure(key_item, text=key_name, font=font, state='normal')
+            canvas.coords(text_item, self.text_width(size, key_name) + 5, y)
+            canvas.itemconfigure(text_item, text=text, font=font, state='normal')
+
+    def get_menu_rows(self, keycode: int) -> list[tuple[str, str]]:
+        """ The (key name, text) rows of a menu, built once per menu for the life of the window. """
+        key = (keycode, self.macros)
+        rows = self.menu_rows.get(key)
+        if rows is None:
+            assert self.macros is not None
+            rows = self.menu_rows[key] = [
+                (f'{get_keyname(macro.activation_keycode)}:', macro.text or '') for macro in self.macros.get_all(keycode)]
+        return rows
+
+    def fit_menu(self, keycode: int, rows: list[tuple[str, str]]) -> int:
+        """
+            The largest font size, up to the text slider's, at which every row of the menu fits
+            the window. Remembered per menu until a slider changes.
+        """
+        key = (keycode, self.macros)
+        size = self.menu_sizes.get(key)
+        if size is not None:
+            return size
 
-        size = 12 + round(self.text_offset)
-        key_label_font = Font(family="Helvetica", size=size, weight="bold")
-        for i, macro in enumerate(self.macros.get_all(keycode)):
-            y = ((key_label_font.metrics('linespace') + 3) * i)
-            
-            key_name = f'{get_keyname(macro.activation_keycode)}:'
-            key_width = key_label_font.measure(key_name)
-            key_label = Label(self.menu_frame, text=key_name, bg='black', fg='white', font=key_label_font, border=0, anchor='w')
-            key_label.place(x=0, y=y, width=key_width, height=key_label_font.metrics('linespace'))
-            # Make sure the text doesnt get cut off
-
-            value = macro.text
-            # for size in reversed(range(1, 100)):
-                
-            #     if font.measure(value) + 60 < self.width and font.metrics('linespace') < 20:
-            #         break
-
-            # key_label_font = Font(family="Helvetica", size=size, weight="bold")
-            value_label = Label(self.menu_frame, text=value, bg='black', fg='white', font=key_label_font, border=0, anchor='w')
-            value_label.place(x=key_width + 5, y=y, width=self.width + self.w_offset - key_width, height=key_label_font.metrics('linespace'))
-
-    def check_hide_menu(self):
-        if self.menu_opened:
-            # check if self.menu_opened was self.menu_close_delay seconds ago using datetime
-            if (datetime.now() - self.menu_opened).total_seconds() > self.menu_close_delay:
-                self.hide_menu()
-                self.current_menu = None
-                self.menu_opened = None
-        self.after(100, self.check_hide_menu)
+        width = self.width + self.w_offset - 3
+        height = self.height + self.h_offset - 80  # the menu starts below the sliders
+
+        def fits(size: int) -> bool:
+            if (self.line_height(size) + 3) * len(rows) > height:
+                return False
+            return all(self.text_width(size, name) + 5 + self.text_width(size, text) <= width for name, text in rows)
+
+        low, high = self.min_font_size, 12 + round(self.text_offset)
+        while low < high:
+            middle = (low + high + 1) // 2
+            if fits(middle):
+                low = middle
+            else:
+                high = middle - 1
+
+        self.menu_sizes[key] = low
+        return low
+
+    def text_width(self, size: int, text: str) -> int:
+        key = (self.menu_font_family, size, text)
+        width = self.text_widths.get(key)
+        if width is None:
+            width = self.text_widths[key] = self.menu_font(size).measure(text)
+        return width
+
+    def line_height(self, size: int) -> int:
+        height = self.line_heights.get(size)
+        if height is None:
+            height = self.line_heights[size] = self.menu_font(size).metrics('linespace')
+        return height
+
+    def menu_font(self, size: int) -> Font:
+        """ One Font per size for the life of the window, each Font is a named Tcl font. """
+        font = self.menu_fonts.get(size)
+        if font is None:
+            font = self.menu_fonts[size] = Font(self, family=self.menu_font_family, size=size, weight="bold")
+        return font
 
     def hide_menu(self):
-        if self.menu_frame:
-            self.menu_frame.destroy()
+        if self.menu_canvas:
+            self.menu_canvas.place_forget()
 
     def minimize(self, e=None):
         self.overrideredirect(False)
@@ -700,14 +992,17 @@ class Overlay(Tk):
 
     def resize_width(self, event):
         self.w_offset = self.width_slider.get()
+        self.menu_sizes.clear()
         self.resize_window()
 
     def resize_height(self, event):
         self.h_offset = self.height_slider.get()
+        self.menu_sizes.clear()
         self.resize_window()
 
     def resize_text(self, event):
         self.text_offset = self.text_size_slider.get()
+        self.menu_sizes.clear()
 
     def startMove(self, event):
         self.x = event.x
@@ -727,31 +1022,157 @@ class Overlay(Tk):
         self.geometry("+%s+%s" % (x, y))
 
     def switch_to_settings(self, e=None):
-        global overlay
-        overlay = False
-        self.stop_keyloop()
-        self.destroy()
+        self.master.show_settings()
 
+    def destroy(self):
+        if self.drain_job:
+            self.after_cancel(self.drain_job)
+            self.drain_job = None
+        self.menu_fonts.clear()
+        super().destroy()
 
-if __name__ == '__main__':
-    macros = None
-    config_filename = None
-    app = None
-    while True:
-        if isinstance(app, MainUI):
-            macros = app.macros
-            config_filename = app.config_filename
-
-        if not isinstance(app, MainUI) and not overlay:
-            logging.log(logging.INFO, 'Starting settings ui!')
-            app = MainUI(macros, config_filename)
-        elif not isinstance(app, Overlay) and overlay:
-            logging.log(logging.INFO, 'Starting overlay ui!')
-            app = Overlay(macros)
+
+class App(Tk):
+    """
+        The one Tk root, kept hidden for the whole session. It owns the engine, whose hook stays
+        installed throughout, and swaps the editor and overlay windows in and out. The editor
+        pauses the engine instead of unhooking it.
+    """
+
+    def __init__(self, macros: Optional[Macros] = None, config_filename: Optional[str] = None, backend=None):
+        super().__init__()
+        self.withdraw()
+
+        self.macros = macros
+        self.config_filename = config_filename
+        if split_engine and backend is None:
+            latency_mode = (latency.priority, latency.cpus) if latency.enabled else None
+            self.engine = RemoteEngine(None, None, store_filename, latency_mode, backend_class, suppress_keys, metrics_port)
         else:
-            break
-        
-        app.mainloop()
+            self.engine = Engine(None, backend or backend_class(), store, None, suppress_keys)
+        self.engine.pause()
+        self.engine.start()
+
+        self.window: Optional[Toplevel] = None
+        self.idle_job = None
+        self.show_settings()
+        self.idle()
+
+    def show_settings(self):
+        if isinstance(self.window, Overlay) and self.engine.profile and self.engine.macros is not self.macros:
+            # A profile hotkey switched macros. A split engine only shares what the overlay draws, the editor needs the real macros
+            self.macros = self.engine.macros if isinstance(self.engine.macros, Macros) else store.get(self.engine.profile) or self.macros
+            self.config_filename = store.sources.get(self.engine.profile)
+
+        logging.log(logging.INFO, 'Starting settings ui!')
+        self.engine.pause()
+        self.swap(lambda: MainUI(self, self.macros, self.config_filename))
+
+    def show_overlay(self):
+        if isinstance(self.window, MainUI):
+            self.macros = self.window.macros
+            self.config_filename = self.window.config_filename
+
+        logging.log(logging.INFO, 'Starting overlay ui!')
+        # Swaps the dispatch tables under the engine's lock, keys pressed meanwhile wait for it rather than being lost
+        self.engine.set_macros(self.macros, profile_name(self.config_filename) if self.config_filename else None)
+        self.engine.resume()
+        self.swap(lambda: Overlay(self))
+
+    def swap(self, make_window):
+        if self.window is not None:
+            self.window.destroy()
+        self.window = make_window()
+
+    def idle(self):
+        # In latency mode garbage is only collected when we say so
+        latency.idle()
+        if isinstance(self.engine, RemoteEngine):
+            for message in self.engine.errors():
+                messagebox.showerror('Error Loading Macros!', message, parent=self.window)
+        self.idle_job = self.after(100, self.idle)
+
+    def destroy(self):
+        if self.idle_job:
+            self.after_cancel(self.idle_job)
+            self.idle_job = None
+        if self.window is not None:
+            self.window.destroy()
+            self.window = None
+        self.engine.stop()
+        super().destroy()
 
 
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='A simple, Rocket League-like macro system.')
+    parser.add_argument('--profile', type=float, nargs='?', const=0, metavar='SECONDS',
+                        help=f'enable profiling: {profile_hotkey} toggles it at any time, and with SECONDS it also runs for that long after starting up')
+    parser.add_argument('--metrics-port', type=int, metavar='PORT',
+                        help='serve live engine statistics at http://127.0.0.1:PORT/metrics')
+    parser.add_argument('--control-port', type=int, metavar='PORT',
+                        help='accept JSON control commands (trigger, load, reload, pause, resume, state) on 127.0.0.1:PORT, '
+                             f'each carrying the token from {pathify("control-token")}')
+    parser.add_argument('--record-trace', metavar='FILE',
+                        help='record every key event to FILE, for replaying with keytrace.py')
+    parser.add_argument('--export', nargs=2, metavar=('PROFILE', 'FILE'),
+                        help='write a stored profile out as a config file (YAML or JSON, by extension) and exit')
+    parser.add_argument('--split', action='store_true',
+                        help='run the keyboard hook and macro playback in their own process, away from the UI')
+    parser.add_argument('--latency', action='store_true',
+                        help='latency mode: collect garbage only when idle and raise the hook and playback threads\' priority')
+    parser.add_argument('--cpus', type=parse_cpus, metavar='LIST',
+                        help='with --latency, pin the hook and playback threads to these CPUs, e.g. 2,3 or 2-5')
+    parser.add_argument('--no-priority', action='store_true',
+                        help='with --latency, leave the process and thread priorities alone')
+    parser.add_argument('--evdev', action='store_true',
+                        help='(Linux) read all keyboards straight from /dev/input instead of through the keyboard library')
+    parser.add_argument('--suppress', action='store_true',
+                        help='swallow the menu and activation keys EMacros uses, so the game never sees them')
+    args = parser.parse_args()
+    if not args.latency and (args.cpus or args.no_priority):
+        parser.error('--cpus and --no-priority only apply with --latency')
+    if args.export:
+        name, filename = args.export
+        if not store.get(name):
+            parser.error(f'no stored profile {name!r}, the store has: {", ".join(store.names()) or "none"}')
+        store.export_yaml(name, filename)
+        print(f'Exported profile {name!r} to {filename}')
+        sys.exit(0)
+    split_engine = args.split
+    suppress_keys = args.suppress
+    if args.evdev:
+        from linuxinput import EvdevBackend
+        backend_class = EvdevBackend
+    if args.latency:
+        latency.enable(priority=not args.no_priority, cpus=args.cpus)
+
+    if args.metrics_port and split_engine:
+        metrics_port = args.metrics_port  # counted in the engine process, so served from there
+    elif args.metrics_port:
+        metrics.serve(args.metrics_port)
+
+    recorder = None
+    if args.record_trace:
+        recorder = TraceRecorder(args.record_trace)
+        KeyboardBackend().hook(recorder)
+
+    if args.profile is not None:
+        # Writing the profile out takes a moment, keep it off the hook thread
+        add_hotkey(profile_hotkey, lambda: Thread(target=profiler.toggle, daemon=True).start())
+    if args.profile:
+        profiler.start(args.profile)
+
+    app = App()
+
+    if args.control_port:
+        control.serve(args.control_port,
+                      lambda: app.engine if isinstance(app.window, Overlay) and isinstance(app.engine, Engine) else None,
+                      control.load_token(pathify('control-token')))
+
+    app.mainloop()
+
+    core.stop()
+    profiler.stop()
+    if recorder:
+        recorder.close()
     logging.log(logging.INFO, 'Closed!')
@@ -0,0 +1,182 @@
+# MIT License
+
+# Copyright (c) 2023 ElliotCS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from abc import ABC, abstractmethod
+from collections import deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import Thread
+from typing import Iterable, Optional
+import logging
+
+
+class Metric(ABC):
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, help: str) -> None:
+        self.name = name
+        self.help = help
+        registry.append(self)
+
+    @abstractmethod
+    def samples(self) -> list[tuple[str, float]]:
+        """ (sample name, value) pairs, in exposition order. """
+
+    def render(self) -> str:
+        lines = [f'# HELP {self.name} {self.help}', f'# TYPE {self.name} {self.kind}']
+        lines.extend(f'{name} {value:g}' for name, value in self.samples())
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str) -> None:
+        super().__init__(name, help)
+        self.value = 0
+
+    def inc(self, amount: int = 1) -> None:
+        self.value += amount
+
+    def samples(self) -> list[tuple[str, float]]:
+        return [(self.name, self.value)]
+
+
+class LabeledCounter(Metric):
+    """ A counter per label value, e.g. one per macro. """
+
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, label: str) -> None:
+        super().__init__(name, help)
+        self.label = label
+        self.values: dict[str, int] = {}
+
+    def inc(self, value: str, amount: int = 1) -> None:
+        self.values[value] = self.values.get(value, 0) + amount
+
+    def samples(self) -> list[tuple[str, float]]:
+        return [(f'{self.name}{{{self.label}="{escape(value)}"}}', count) for value, count in list(self.values.items())]
+
+
+class Gauge(Metric):
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str) -> None:
+        super().__init__(name, help)
+        self.value = 0.0
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def samples(self) -> list[tuple[str, float]]:
+        return [(self.name, self.value)]
+
+
+class Summary(Metric):
+    """ Tracks the count and sum of observations, and quantiles over the most recent ones. """
+
+    kind = 'summary'
+    quantiles = (0.5, 0.9, 0.99, 0.999)
+
+    def __init__(self, name: str, help: str, window: int = 4096) -> None:
+        super().__init__(name, help)
+        self.recent: deque[float] = deque(maxlen=window)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.recent.append(value)
+        self.count += 1
+        self.sum += value
+
+    def percentiles(self, qs: Iterable[float]) -> list[float]:
+        """ The recent observations at each quantile in qs, sorting them once. """
+        recent = sorted(self.recent)
+        if not recent:
+            return [float('nan') for _ in qs]
+        return [recent[min(len(recent) - 1, int(q * len(recent)))] for q in qs]
+
+    def percentile(self, q: float) -> float:
+        return self.percentiles((q,))[0]
+
+    def samples(self) -> list[tuple[str, float]]:
+        out = [(f'{self.name}{{quantile="{q}"}}', value)
+               for q, value in zip(self.quantiles, self.percentiles(self.quantiles))]
+        out.append((f'{self.name}_sum', self.sum))
+        out.append((f'{self.name}_count', self.count))
+        return out
+
+
+def escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+registry: list[Metric] = []
+
+hook_events = Counter('emacros_hook_events_total', 'Keyboard events seen by the hook.')
+hook_filtered = Counter('emacros_hook_events_filtered_total', 'Keyboard events ignored because no macro uses the key.')
+hook_seconds = Summary('emacros_hook_seconds', 'Time spent handling one keyboard event on the hook thread.')
+menus_opened = Counter('emacros_menus_opened_total', 'Menus opened.')
+menus_expired = Counter('emacros_menus_expired_total', 'Menus closed because nothing was chosen in time.')
+macros_played = LabeledCounter('emacros_macros_played_total', 'Macros played.', 'macro')
+injected_events = Counter('emacros_injected_events_total', 'Key presses and releases sent by macros.')
+queue_depth = Gauge('emacros_playback_queue_depth', 'Macros waiting in the chat scheduler.')
+trigger_latency = Summary('emacros_trigger_latency_seconds', 'Time from a macro being triggered to it starting to play.')
+play_seconds = Summary('emacros_play_seconds', 'Time taken to play a macro.')
+
+
+def render() -> str:
+    return '\n'.join(metric.render() for metric in registry) + '\n'
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self) -> None:
+        if self.path not in ('/', '/metrics'):
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+
+def serve(port: int, host: str = '127.0.0.1') -> Optional[ThreadingHTTPServer]:
+    """ Serves the metrics at http://host:port/metrics from a background thread. """
+    try:
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+    except OSError:
+        logging.exception(f'Could not serve metrics on {host}:{port}')
+        return None
+    server.daemon_threads = True
+    Thread(target=server.serve_forever, name='Metrics', daemon=True).start()
+    logging.log(logging.INFO, f'Serving metrics on http://{host}:{port}/metrics')
+    return server
@@ -0,0 +1,131 @@
+# MIT License
+
+# Copyright (c) 2023 ElliotCS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from collections import Counter
+from datetime import datetime
+from threading import Event, Lock, Thread, Timer, current_thread, enumerate as threads
+from typing import Optional
+import logging
+import os
+import sys
+import tracemalloc
+
+
+def frame_name(frame) -> str:
+    code = frame.f_code
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'
+
+
+class Profiler:
+    """
+        A sampling profiler for every thread (hook, Tk mainloop and playback) plus tracemalloc.
+
+        Nothing is hooked while it is off. When it stops it writes a collapsed-stack file
+        (for flamegraph.pl or speedscope) and a tracemalloc snapshot diff to `directory`.
+    """
+
+    def __init__(self, directory: str, interval: float = 0.005) -> None:
+        self.directory = directory
+        self.interval = interval
+        self.lock = Lock()
+        self.stopped = Event()
+        self.sampler: Optional[Thread] = None
+        self.timer: Optional[Timer] = None
+        self.stacks: Counter = Counter()
+        self.started: Optional[datetime] = None
+        self.snapshot: Optional[tracemalloc.Snapshot] = None
+
+    @property
+    def running(self) -> bool:
+        return self.sampler is not None
+
+    def toggle(self, duration: Optional[float] = None) -> None:
+        if self.running:
+            self.stop()
+        else:
+            self.start(duration)
+
+    def start(self, duration: Optional[float] = None) -> None:
+        """ Starts profiling, stopping by itself after `duration` seconds if given. """
+        with self.lock:
+            if self.sampler is not None:
+                return
+            logging.log(logging.INFO, f'Profiling started{f" for {duration}s" if duration else ""}')
+            self.stacks = Counter()
+            self.started = datetime.now()
+            tracemalloc.start(10)
+            self.snapshot = tracemalloc.take_snapshot()
+            self.stopped.clear()
+            self.sampler = Thread(target=self._sample, name='Profiler', daemon=True)
+            self.sampler.start()
+            if duration:
+                self.timer = Timer(duration, self.stop)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def stop(self) -> None:
+        with self.lock:
+            if self.sampler is None:
+                return
+            self.stopped.set()
+            if self.sampler is not current_thread():
+                self.sampler.join()
+            self.sampler = None
+            if self.timer is not None and self.timer is not current_thread():
+                self.timer.cancel()
+            self.timer = None
+
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            self._write(snapshot)
+
+    def _sample(self) -> None:
+        me = current_thread().ident
+        while not self.stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threads()}
+            for ident, frame in sys._current_frames().items():
+                if ident == me:
+                    continue
+                stack = []
+                while frame is not None:
+                    stack.append(frame_name(frame))
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.stacks[';'.join(reversed(stack))] += 1
+
+    def _write(self, snapshot: tracemalloc.Snapshot) -> None:
+        assert self.started is not None and self.snapshot is not None
+        name = os.path.join(self.directory, f'profile {self.started.strftime("%Y-%m-%d %H-%M-%S")}')
+
+        with open(f'{name}.folded', 'w', encoding='utf-8') as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f'{stack} {count}\n')
+
+        with open(f'{name}.memory.txt', 'w', encoding='utf-8') as f:
+            for stat in snapshot.compare_to(self.snapshot, 'traceback')[:50]:
+                f.write(f'{stat}\n')
+                for line in stat.traceback.format():
+                    f.write(f'    {line}\n')
+
+        self.snapshot = None
+        logging.log(logging.INFO, f'Profile written to {name}.folded and {name}.memory.txt')
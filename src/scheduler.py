@@ -0,0 +1,251 @@
+# MIT License
+
+# Copyright (c) 2023 ElliotCS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from __future__ import annotations
+from typing import Callable, Optional, TYPE_CHECKING
+if TYPE_CHECKING:
+    from macros import Macro
+from concurrent.futures import Future
+from heapq import heappush, heappop
+from threading import RLock
+from time import monotonic, perf_counter
+import asyncio
+import logging
+from core import core
+from latency import latency
+import metrics
+
+
+class TokenBucket:
+    """ Allows `capacity` messages per `window` seconds, refilling continuously. """
+
+    def __init__(self, capacity: int = 3, window: float = 2.0, clock: Callable[[], float] = monotonic) -> None:
+        if capacity < 1 or window <= 0:
+            raise ValueError(f'Invalid rate limit: {capacity} messages per {window} seconds.')
+        self.capacity = capacity
+        self.window = window
+        self.rate = capacity / window
+        self.clock = clock
+        self.tokens = float(capacity)
+        self.updated = clock()
+
+    def refill(self, now: float) -> None:
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def try_take(self, now: Optional[float] = None) -> bool:
+        """ Takes a token if one is available. """
+        self.refill(self.clock() if now is None else now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def next_available(self, now: Optional[float] = None) -> float:
+        """ Returns the earliest time at which a token can be taken. """
+        now = self.clock() if now is None else now
+        self.refill(now)
+        if self.tokens >= 1:
+            return now
+        return now + (1 - self.tokens) / self.rate
+
+
+class ChatScheduler:
+    """
+        Sits in front of Macro.play so we never send chat faster than the game accepts.
+
+        Macros that arrive while the bucket is empty are queued and played at the
+        earliest allowed instant, highest priority first. A macro with the same text
+        as one already waiting is merged into it instead of being queued twice.
+
+        The queue is drained by a coroutine on the engine loop, which only exists while
+        there is something to play.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 3,
+        window: float = 2.0,
+        max_queue: int = 8,
+        max_delay: float = 5.0,
+        clock: Callable[[], float] = monotonic
+    ) -> None:
+        self.bucket = TokenBucket(capacity, window, clock)
+        self.max_queue = max_queue
+        self.max_delay = max_delay
+        self.clock = clock
+
+        # (-priority, sequence, submitted, macro)
+        self.queue: list[tuple[int, int, float, Macro]] = []
+        self.queued_texts: dict[str, int] = {}
+        self.sequence = 0
+
+        self.played = 0
+        self.dropped = 0
+        self.deferred = 0
+        self.merged = 0
+
+        self.lock = RLock()  # macros are submitted from the hook, control and UI threads
+        self.task: Optional[Future] = None
+        self.wakeup: Optional[asyncio.Event] = None
+        self.backend = None  # where macros are played, None for the real keyboard
+
+    def configure(self, capacity: int, window: float) -> None:
+        with self.lock:
+            self.bucket = TokenBucket(capacity, window, self.clock)
+            if self.task is not None:
+                core.call(self._wake)
+
+    def submit(self, macro: Macro) -> None:
+        """ Queues a macro for playback, respecting the rate limit. """
+        with self.lock:
+            now = self.clock()
+
+            if macro.text in self.queued_texts:
+                self.merged += 1
+                self._raise_priority(macro)
+                logging.log(logging.INFO, f'Merged macro {macro.name} into a queued duplicate')
+                return
+
+            if len(self.queue) >= self.max_queue and not self._evict_for(macro):
+                self.dropped += 1
+                logging.log(logging.INFO, f'Dropped macro {macro.name}, queue is full')
+                return
+
+            if self.queue or self.bucket.next_available(now) > now:
+                self.deferred += 1
+
+            self.sequence += 1
+            heappush(self.queue, (-macro.priority, self.sequence, now, macro))
+            self.queued_texts[macro.text] = self.queued_texts.get(macro.text, 0) + 1
+            metrics.queue_depth.set(len(self.queue))
+
+            if self.task is None:
+                self.task = core.spawn(self._run())
+
+    def clear(self) -> None:
+        """ Drops the queued macros. One already playing finishes. """
+        with self.lock:
+            self.dropped += len(self.queue)
+            self.queue.clear()
+            self.queued_texts.clear()
+            metrics.queue_depth.set(0)
+
+    def cancel(self) -> None:
+        """ Drops the queued macros and stops the one playing, releasing any keys it held. """
+        with self.lock:
+            self.clear()
+            if self.task is not None:
+                self.task.cancel()
+                self.task = None
+
+    def stats(self) -> dict[str, int]:
+        return {
+            'played': self.played,
+            'dropped': self.dropped,
+            'deferred': self.deferred,
+            'merged': self.merged,
+            'queued': len(self.queue),
+        }
+
+    def _raise_priority(self, macro: Macro) -> None:
+        for i, (priority, sequence, submitted, queued) in enumerate(self.queue):
+            if queued.text == macro.text and -priority < macro.priority:
+                self.queue[i] = (-macro.priority, sequence, submitted, queued)
+                self.queue.sort()
+                return
+
+    def _evict_for(self, macro: Macro) -> bool:
+        """ Makes room by dropping the lowest priority, newest queued macro if it ranks below `macro`. """
+        worst = max(self.queue)
+        if -worst[0] >= macro.priority:
+            return False
+        self.queue.remove(worst)
+        self.queue.sort()
+        self._forget(worst[3])
+        self.dropped += 1
+        return True
+
+    def _forget(self, macro: Macro) -> None:
+        count = self.queued_texts.get(macro.text, 0) - 1
+        if count > 0:
+            self.queued_texts[macro.text] = count
+        else:
+            self.queued_texts.pop(macro.text, None)
+
+    def _next(self) -> tuple[Optional[Macro], float]:
+        """ Returns the next macro that may be played now, or (None, seconds until one may be). (None, 0) when idle. """
+        while self.queue:
+            now = self.clock()
+            _, _, submitted, macro = self.queue[0]
+            if now - submitted > self.max_delay:
+                heappop(self.queue)
+                self._forget(macro)
+                self.dropped += 1
+                logging.log(logging.INFO, f'Dropped macro {macro.name}, waited too long')
+                continue
+
+            ready = self.bucket.next_available(now)
+            if ready > now:
+                return None, ready - now
+
+            self.bucket.try_take(now)
+            heappop(self.queue)
+            self._forget(macro)
+            metrics.queue_depth.set(len(self.queue))
+            metrics.trigger_latency.observe(now - submitted)
+            return macro, 0
+        return None, 0
+
+    def _wake(self) -> None:
+        if self.wakeup is not None:
+            self.wakeup.set()
+
+    async def _run(self) -> None:
+        self.wakeup = asyncio.Event()
+        while True:
+            with self.lock:
+                macro, delay = self._next()
+                if macro is None and not delay:
+                    self.task = None
+                    return
+
+            if macro is None:
+                # Wait for a token, or for configure to change the rate limit
+                self.wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                start = perf_counter()
+                with latency.playing():
+                    await macro.play_async(self.backend)
+                metrics.play_seconds.observe(perf_counter() - start)
+                metrics.macros_played.inc(macro.name)
+                self.played += 1
+            except Exception:
+                logging.exception(f'Failed to play macro {macro.name}')
@@ -0,0 +1,139 @@
+# MIT License
+
+# Copyright (c) 2023 ElliotCS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from __future__ import annotations
+from typing import Optional, TYPE_CHECKING
+if TYPE_CHECKING:
+    from macros import Macro, Macros
+from bisect import bisect_left, insort
+from keycodes import keyname_to_code, get_keyname
+import re
+
+word = re.compile(r'\w+|[^\w\s]')
+
+
+def macro_terms(macro: Macro) -> set[str]:
+    """ Returns the lowercased words of the macro's text plus the names of its keys. """
+    terms = set(word.findall((macro.text or '').lower()))
+    if macro.menu_keycode != -1:
+        terms.add(get_keyname(macro.menu_keycode).lower())
+    if macro.activation_keycode != -1:
+        terms.add(get_keyname(macro.activation_keycode).lower())
+    return terms
+
+
+class MacroIndex:
+    """
+        An inverted index over macro text and key names, kept up to date from Macros' change notifications.
+
+        Every query word is treated as a prefix, so results can be refreshed on each keystroke.
+        A `menu:<key>` word (or `menu:none` for solo macros) filters by menu key.
+    """
+
+    def __init__(self, macros: Macros) -> None:
+        self.macros = macros
+        self.postings: dict[str, set[Macro]] = {}
+        self.terms_of: dict[Macro, set[str]] = {}
+        self.sorted_terms: list[str] = []
+
+        for macro in macros.get_all():
+            self.add(macro)
+        macros.subscribe(self.on_change)
+
+    def close(self) -> None:
+        self.macros.unsubscribe(self.on_change)
+
+    def on_change(self, changes: list[tuple[str, Macro]]) -> None:
+        for kind, macro in changes:
+            if kind == 'remove':
+                self.remove(macro)
+            else:
+                self.add(macro)
+
+    def add(self, macro: Macro) -> None:
+        """ Indexes a macro, replacing whatever was indexed for it before. """
+        terms = macro_terms(macro)
+        old = self.terms_of.get(macro, set())
+        for term in old - terms:
+            self._unpost(term, macro)
+        for term in terms - old:
+            postings = self.postings.get(term)
+            if postings is None:
+                postings = self.postings[term] = set()
+                insort(self.sorted_terms, term)
+            postings.add(macro)
+        self.terms_of[macro] = terms
+
+    def remove(self, macro: Macro) -> None:
+        for term in self.terms_of.pop(macro, ()):
+            self._unpost(term, macro)
+
+    def _unpost(self, term: str, macro: Macro) -> None:
+        postings = self.postings[term]
+        postings.discard(macro)
+        if not postings:
+            del self.postings[term]
+            del self.sorted_terms[bisect_left(self.sorted_terms, term)]
+
+    def prefix(self, prefix: str) -> set[Macro]:
+        """ Returns every macro with a term starting with `prefix`. """
+        if prefix in self.postings and not self._has_longer(prefix):
+            return self.postings[prefix]
+
+        out: set[Macro] = set()
+        i = bisect_left(self.sorted_terms, prefix)
+        while i < len(self.sorted_terms) and self.sorted_terms[i].startswith(prefix):
+            out |= self.postings[self.sorted_terms[i]]
+            i += 1
+        return out
+
+    def _has_longer(self, term: str) -> bool:
+        i = bisect_left(self.sorted_terms, term) + 1
+        return i < len(self.sorted_terms) and self.sorted_terms[i].startswith(term)
+
+    def search(self, query: str, menu_keycode: Optional[int] = None) -> list[Macro]:
+        """ Returns the macros matching every word of `query`, in the same order as Macros.get_all. """
+        words = []
+        for token in query.lower().split():
+            if token.startswith('menu:'):
+                name = token[len('menu:'):]
+                menu_keycode = -1 if name == 'none' else keyname_to_code.get(name, -2)
+            else:
+                words.extend(word.findall(token))
+
+        if not words:
+            if menu_keycode is None:
+                return self.macros.get_all()
+            return self.macros.get_all(menu_keycode)
+
+        matches = sorted((self.prefix(w) for w in words), key=len)
+        result = set(matches[0])
+        for other in matches[1:]:
+            result &= other
+            if not result:
+                break
+
+        if menu_keycode is not None:
+            result = {macro for macro in result if macro.menu_keycode == menu_keycode}
+
+        return sorted(result, key=lambda macro: (get_keyname(macro.menu_keycode, ''), get_keyname(macro.activation_keycode, '')))
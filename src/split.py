@@ -0,0 +1,327 @@
+# MIT License
+
+# Copyright (c) 2023 ElliotCS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+    Runs the hook, dispatch and playback in their own process, so neither Tk nor the UI's
+    garbage collector can delay a key event.
+
+    The engine process publishes what the overlay needs to draw menus as a snapshot in
+    shared memory, and every menu change through a ring buffer, also in shared memory.
+    The UI process never blocks the engine: it only polls both from its frame loop.
+"""
+
+from __future__ import annotations
+from typing import NamedTuple, Optional
+from multiprocessing import Pipe, Process
+from multiprocessing.connection import Connection
+from multiprocessing.shared_memory import SharedMemory
+from struct import Struct
+from latency import latency
+import json
+import logging
+
+u64 = Struct('<Q')
+u32_pair = Struct('<II')
+menu_record = Struct('<q')
+
+RING_SLOTS = 1024
+RING_DATA = 64  # head, tail and dropped counters, each on its own 8 bytes
+SNAPSHOT_SIZE = 1 << 20
+
+
+def attach(name: str) -> SharedMemory:
+    try:
+        return SharedMemory(name, track=False)  # the UI process created it and unlinks it
+    except TypeError:  # before Python 3.13
+        return SharedMemory(name)
+
+
+class MenuRing:
+    """
+        A single-producer, single-consumer ring of menu changes: a menu keycode when one
+        opens, None when it closes. The engine process only moves `head` and the UI only
+        moves `tail`, each with a single aligned 8-byte write after the slot itself, so
+        neither needs a lock. When the UI falls a whole ring behind, new records are
+        dropped and counted instead of overwriting ones it hasn't read.
+
+        Quacks like the deque Engine.menu_events normally is.
+    """
+
+    def __init__(self, shm: SharedMemory) -> None:
+        self.shm = shm
+        self.buf = shm.buf
+        self.slots = (len(self.buf) - RING_DATA) // menu_record.size
+
+    @classmethod
+    def create(cls) -> MenuRing:
+        return cls(SharedMemory(create=True, size=RING_DATA + RING_SLOTS * menu_record.size))
+
+    def append(self, keycode: Optional[int]) -> None:
+        buf = self.buf
+        head = u64.unpack_from(buf, 0)[0]
+        if head - u64.unpack_from(buf, 8)[0] >= self.slots:
+            u64.pack_into(buf, 16, u64.unpack_from(buf, 16)[0] + 1)
+            return
+        menu_record.pack_into(buf, RING_DATA + head % self.slots * menu_record.size, -1 if keycode is None else keycode)
+        u64.pack_into(buf, 0, head + 1)
+
+    def popleft(self) -> Optional[int]:
+        buf = self.buf
+        tail = u64.unpack_from(buf, 8)[0]
+        if tail == u64.unpack_from(buf, 0)[0]:
+            raise IndexError('pop from an empty ring')
+        keycode = menu_record.unpack_from(buf, RING_DATA + tail % self.slots * menu_record.size)[0]
+        u64.pack_into(buf, 8, tail + 1)
+        return None if keycode == -1 else keycode
+
+    def __len__(self) -> int:
+        return u64.unpack_from(self.buf, 0)[0] - u64.unpack_from(self.buf, 8)[0]
+
+    def dropped(self) -> int:
+        return u64.unpack_from(self.buf, 16)[0]
+
+    def close(self, unlink: bool = False) -> None:
+        self.buf = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class Snapshot:
+    """
+        What the UI needs to draw menus, as JSON in shared memory behind a sequence lock:
+        the writer makes the sequence odd while it copies, so a reader that sees an odd
+        or changed sequence knows to try again next frame.
+    """
+
+    def __init__(self, shm: SharedMemory) -> None:
+        self.shm = shm
+        self.buf = shm.buf
+
+    @classmethod
+    def create(cls, size: int = SNAPSHOT_SIZE) -> Snapshot:
+        return cls(SharedMemory(create=True, size=size))
+
+    def publish(self, data: bytes) -> None:
+        if len(data) > len(self.buf) - u32_pair.size:
+            logging.log(logging.WARNING, f'Config snapshot of {len(data)} bytes does not fit in shared memory')
+            return
+        sequence = u32_pair.unpack_from(self.buf, 0)[0]
+        u32_pair.pack_into(self.buf, 0, sequence + 1, 0)
+        self.buf[u32_pair.size:u32_pair.size + len(data)] = data
+        u32_pair.pack_into(self.buf, 0, sequence + 2, len(data))
+
+    def read(self, last: int) -> Optional[tuple[int, bytes]]:
+        """ Returns (sequence, data) if a complete snapshot newer than `last` is there. """
+        sequence, length = u32_pair.unpack_from(self.buf, 0)
+        if sequence == last or sequence & 1:
+            return None
+        data = bytes(self.buf[u32_pair.size:u32_pair.size + length])
+        if u32_pair.unpack_from(self.buf, 0)[0] != sequence:
+            return None
+        return sequence, data
+
+    def close(self, unlink: bool = False) -> None:
+        self.buf = None
+        self.shm.close()
+        if unlink:
+            self.shm.unlink()
+
+
+class MenuEntry(NamedTuple):
+    activation_keycode: int
+    text: str
+
+
+class MenuView:
+    """ The read-only side of a config the overlay draws from, decoded from a snapshot. """
+
+    def __init__(self, profile: Optional[str], menus: dict[int, list[MenuEntry]]) -> None:
+        self.profile = profile
+        self.menus = menus
+
+    @classmethod
+    def decode(cls, data: bytes) -> MenuView:
+        snapshot = json.loads(data)
+        menus = {menu: [MenuEntry(*entry) for entry in entries] for menu, entries in snapshot['menus']}
+        return cls(snapshot['profile'], menus)
+
+    def get_all(self, keycode: Optional[int] = None) -> list[MenuEntry]:
+        if keycode is None:
+            return [entry for entries in self.menus.values() for entry in entries]
+        return self.menus.get(keycode, [])
+
+
+def encode_snapshot(macros, profile: Optional[str]) -> bytes:
+    menus = []
+    if macros:
+        for menu in macros.menus:
+            menus.append([menu, [[macro.activation_keycode, macro.text] for macro in macros.get_all(menu)]])
+    return json.dumps({'profile': profile, 'menus': menus}, ensure_ascii=False).encode('utf-8')
+
+
+def run_engine(data: Optional[dict], profile: Optional[str], store_filename: Optional[str],
+               ring_name: str, snapshot_name: str, conn: Connection,
+               latency_mode: Optional[tuple[bool, Optional[set[int]]]] = None, backend_class=None,
+               suppress: bool = False, metrics_port: Optional[int] = None) -> None:
+    """
+        The engine process: owns the hook and playback until told to stop. Macros that fail
+        to load are reported back as ('error', message) and the previous ones stay in use.
+        The metrics are counted here, so they are served from here too.
+    """
+    from backends import KeyboardBackend
+    from engine import Engine
+    from loader import ConfigError
+    from strictyaml.exceptions import MarkedYAMLError, YAMLValidationError
+    from macros import Macros
+    from store import ProfileStore
+    import metrics
+
+    if latency_mode:
+        latency.enable(*latency_mode)
+    if metrics_port:
+        metrics.serve(metrics_port)
+
+    ring = MenuRing(attach(ring_name))
+    snapshot = Snapshot(attach(snapshot_name))
+    store = ProfileStore(store_filename) if store_filename else None
+    macros = Macros(None, data=data) if data is not None else None
+
+    engine = Engine(macros, (backend_class or KeyboardBackend)(), store, profile, suppress)
+    engine.menu_events = ring  # type: ignore
+    published = engine.macros
+    snapshot.publish(encode_snapshot(published, engine.profile))
+    engine.start()
+    logging.log(logging.INFO, 'Engine process started')
+
+    try:
+        while True:
+            if conn.poll(0.05):
+                command, *args = conn.recv()
+                if command == 'stop':
+                    break
+                try:
+                    if command == 'load':
+                        engine.load(*args)
+                    elif command == 'set':
+                        data, profile, rate_limit = args
+                        if store:
+                            store.reload()  # decodes only profiles the editor stored since
+                        engine.set_macros(Macros(None, rate_limit, data) if data is not None else None, profile)
+                    elif command == 'pause':
+                        engine.pause()
+                    elif command == 'resume':
+                        engine.resume()
+                except (ConfigError, YAMLValidationError, MarkedYAMLError, OSError) as e:
+                    logging.exception(f'Could not {command} macros, keeping the previous ones')
+                    conn.send(('error', str(e)))
+            engine.expire()
+            if engine.macros is not published:
+                published = engine.macros
+                snapshot.publish(encode_snapshot(published, engine.profile))
+    finally:
+        engine.stop()
+        ring.close()
+        snapshot.close()
+        logging.log(logging.INFO, 'Engine process stopped')
+
+
+class RemoteEngine:
+    """
+        Stands in for Engine in the UI process when the engine runs in its own process.
+        Offers the parts of Engine the app uses: menu_events, macros, profile, set_macros,
+        pause, resume, expire, start and stop.
+    """
+
+    def __init__(self, macros, profile: Optional[str] = None, store_filename: Optional[str] = None,
+                 latency_mode: Optional[tuple[bool, Optional[set[int]]]] = None, backend_class=None,
+                 suppress: bool = False, metrics_port: Optional[int] = None) -> None:
+        self.menu_events = MenuRing.create()
+        self.snapshot = Snapshot.create()
+        self.sequence = 0
+        self.view = MenuView(profile, {})
+        self.conn, child_conn = Pipe()
+        self.process = Process(
+            target=run_engine,
+            args=(macros.to_data(force=True) if macros else None, profile, store_filename,
+                  self.menu_events.shm.name, self.snapshot.shm.name, child_conn, latency_mode, backend_class, suppress,
+                  metrics_port),
+            name='Engine',
+            daemon=True
+        )
+
+    @property
+    def macros(self) -> MenuView:
+        """ The latest snapshot the engine published, e.g. after a profile hotkey. """
+        update = self.snapshot.read(self.sequence)
+        if update is not None:
+            self.sequence, data = update
+            self.view = MenuView.decode(data)
+        return self.view
+
+    @property
+    def profile(self) -> Optional[str]:
+        return self.macros.profile
+
+    def start(self) -> None:
+        if not self.process.is_alive() and self.process.exitcode is None:
+            self.process.start()
+
+    def load(self, filename: str) -> None:
+        self.conn.send(('load', filename))
+
+    def set_macros(self, macros, profile: Optional[str] = None) -> None:
+        rate_limit = (macros.scheduler.bucket.capacity, macros.scheduler.bucket.window) if macros else None
+        self.conn.send(('set', macros.to_data(force=True) if macros else None, profile, rate_limit))
+
+    def pause(self) -> None:
+        self.conn.send(('pause',))
+
+    def resume(self) -> None:
+        self.conn.send(('resume',))
+
+    def expire(self) -> None:
+        """ Menus expire in the engine process, this is only the UI's idle moment. """
+        latency.idle()
+
+    def errors(self) -> list[str]:
+        """ Messages for macros the engine process couldn't load since the last call. """
+        errors = []
+        while self.process.is_alive() and self.conn.poll():
+            kind, message = self.conn.recv()
+            if kind == 'error':
+                errors.append(message)
+        return errors
+
+    def stop(self) -> None:
+        if self.process.is_alive():
+            self.conn.send(('stop',))
+            self.process.join(2.0)
+            if self.process.is_alive():
+                self.process.terminate()
+        if self.menu_events.buf is not None:
+            dropped = self.menu_events.dropped()
+            if dropped:
+                logging.log(logging.WARNING, f'{dropped} menu changes were dropped, the UI fell behind')
+            self.menu_events.close(unlink=True)
+            self.snapshot.close(unlink=True)
@@ -0,0 +1,230 @@
+# MIT License
+
+# Copyright (c) 2023 ElliotCS
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+from typing import Optional
+from macros import Macros
+from loader import dumps, config_extensions
+from keycodes import get_keyname
+from threading import RLock
+import json
+import logging
+import os
+import sqlite3
+import time
+
+
+def profile_name(filename: str) -> str:
+    return os.path.splitext(os.path.basename(filename))[0]
+
+
+class ProfileStore:
+    """
+        Keeps every profile's validated macros in one SQLite database.
+
+        All profiles are decoded into Macros objects when the store opens, so
+        switching profiles is a dict lookup and never touches YAML or disk.
+
+        The UI, engine and control threads all use the store, so the
+        connection is shared between threads and serialised by a lock.
+    """
+
+    def __init__(self, filename: str) -> None:
+        self.db = sqlite3.connect(filename, check_same_thread=False)
+        self.lock = RLock()
+        with self.lock:
+            self.db.execute('''
+                CREATE TABLE IF NOT EXISTS profiles (
+                    name TEXT PRIMARY KEY,
+                    macros TEXT NOT NULL,
+                    source TEXT,
+                    hotkey INTEGER UNIQUE,
+                    rate_capacity INTEGER NOT NULL DEFAULT 3,
+                    rate_window REAL NOT NULL DEFAULT 2.0,
+                    updated REAL NOT NULL
+                )
+            ''')
+            self.db.commit()
+
+        self.profiles: dict[str, Macros] = {}
+        self.sources: dict[str, Optional[str]] = {}
+        self.hotkeys: dict[int, str] = {}
+        self.updated: dict[str, float] = {}  # when each profile in memory was stored
+        self.reload()
+
+    def reload(self) -> None:
+        """
+            Brings the profiles in memory up to date with the database, e.g. after another
+            process stored some. Only profiles stored since they were last decoded are decoded.
+        """
+        profiles = {}
+        sources = {}
+        hotkeys = {}
+        updated = {}
+        decoded = 0
+        with self.lock:
+            rows = self.db.execute(
+                'SELECT name, source, hotkey, rate_capacity, rate_window, updated FROM profiles').fetchall()
+        for name, source, hotkey, capacity, window, stored in rows:
+            macros = self.profiles.get(name)
+            if macros is None or self.updated.get(name) != stored:
+                with self.lock:
+                    data = self.db.execute('SELECT macros FROM profiles WHERE name = ?', (name,)).fetchone()[0]
+                try:
+                    macros = Macros(source, (capacity, window), json.loads(data))
+                except Exception:
+                    logging.exception(f'Skipping broken profile {name}')
+                    continue
+                decoded += 1
+            elif (macros.scheduler.bucket.capacity, macros.scheduler.bucket.window) != (capacity, window):
+                macros.scheduler.configure(capacity, window)
+            profiles[name] = macros
+            sources[name] = source
+            updated[name] = stored
+            if hotkey is not None:
+                hotkeys[hotkey] = name
+
+        self.profiles = profiles
+        self.sources = sources
+        self.hotkeys = hotkeys
+        self.updated = updated
+        logging.log(logging.INFO, f'Loaded {len(profiles)} profiles from the store, {decoded} of them changed')
+
+    def names(self) -> list[str]:
+        return sorted(self.profiles)
+
+    def get(self, name: str) -> Optional[Macros]:
+        return self.profiles.get(name)
+
+    def put(self, name: str, macros: Macros, source: Optional[str] = None) -> None:
+        """ Stores (or replaces) a profile, keeping its hotkey and rate limit. """
+        data = json.dumps(macros.to_data(force=True))
+        stored = time.time()
+        with self.lock:
+            self.db.execute('''
+                INSERT INTO profiles (name, macros, source, updated) VALUES (?, ?, ?, ?)
+                ON CONFLICT(name) DO UPDATE SET macros=excluded.macros, source=excluded.source, updated=excluded.updated
+            ''', (name, data, source, stored))
+            self.db.commit()
+            capacity, window = self.db.execute(
+                'SELECT rate_capacity, rate_window FROM profiles WHERE name = ?', (name,)).fetchone()
+        macros.scheduler.configure(capacity, window)
+        macros.arm_macros()  # so switching to the profile is only a swap
+        self.profiles[name] = macros
+        self.sources[name] = source
+        self.updated[name] = stored
+
+    def delete(self, name: str) -> None:
+        with self.lock:
+            self.db.execute('DELETE FROM profiles WHERE name = ?', (name,))
+            self.db.commit()
+        self.profiles.pop(name, None)
+        self.sources.pop(name, None)
+        self.updated.pop(name, None)
+        self.hotkeys = {key: profile for key, profile in self.hotkeys.items() if profile != name}
+
+    def set_hotkey(self, name: str, hotkey: Optional[int]) -> None:
+        """ Binds a key that switches to this profile from the overlay. None unbinds it. """
+        with self.lock:
+            if hotkey is not None:
+                self.db.execute('UPDATE profiles SET hotkey = NULL WHERE hotkey = ?', (hotkey,))
+            self.db.execute('UPDATE profiles SET hotkey = ? WHERE name = ?', (hotkey, name))
+            self.db.commit()
+
+        hotkeys = {key: profile for key, profile in self.hotkeys.items() if profile != name}
+        if hotkey is not None:
+            hotkeys[hotkey] = name
+        self.hotkeys = hotkeys
+
+    def verify_hotkey(self, name: str, hotkey: int, macros: Optional[Macros] = None) -> tuple[int, str]:
+        """ Checks whether `hotkey` can switch to profile `name`, whose macros may be passed when they aren't stored yet.
+
+        Returns:
+            0: No errors
+            1: The key has no name, so it can't be bound
+            2: The key already switches to another profile
+            3: The key opens a menu or plays a solo macro in some profile, which it would stop doing
+        """
+        if get_keyname(hotkey, None) is None:
+            return 1, f'Key {hotkey} is not a key EMacros knows.'
+
+        owner = self.hotkeys.get(hotkey)
+        if owner is not None and owner != name:
+            return 2, f'{get_keyname(hotkey)} already switches to profile {owner!r}.'
+
+        # Profile keys are checked before menus and solo keys, in every profile
+        profiles = self.profiles | ({name: macros} if macros else {})
+        for profile, profile_macros in sorted(profiles.items()):
+            snapshot = profile_macros.snapshot
+            if hotkey in snapshot.menus:
+                return 3, f'{get_keyname(hotkey)} opens a menu in profile {profile!r}.'
+            if (macro := snapshot.get_macro(-1, hotkey)) is not None:
+                return 3, f'{get_keyname(hotkey)} plays macro {macro.name!r} in profile {profile!r}.'
+
+        return 0, ''
+
+    def get_hotkey(self, name: str) -> Optional[int]:
+        for key, profile in self.hotkeys.items():
+            if profile == name:
+                return key
+        return None
+
+    def get_rate_limit(self, name: str) -> tuple[int, float]:
+        """ (messages, per seconds) the profile's chat scheduler allows. """
+        with self.lock:
+            row = self.db.execute('SELECT rate_capacity, rate_window FROM profiles WHERE name = ?', (name,)).fetchone()
+        return (row[0], row[1]) if row else (3, 2.0)
+
+    def set_rate_limit(self, name: str, capacity: int, window: float) -> None:
+        """ Limits the profile to `capacity` chat messages per `window` seconds. """
+        with self.lock:
+            self.db.execute('UPDATE profiles SET rate_capacity = ?, rate_window = ? WHERE name = ?', (capacity, window, name))
+            self.db.commit()
+        if name in self.profiles:
+            self.profiles[name].scheduler.configure(capacity, window)
+
+    def import_yaml(self, filename: str, name: Optional[str] = None) -> str:
+        """ Validates a config file (YAML or JSON) and stores it as a profile. """
+        name = name or profile_name(filename)
+        self.put(name, Macros(filename), filename)
+        return name
+
+    def export_yaml(self, name: str, filename: str) -> None:
+        """ Writes a profile out as a config file, in the format matching the extension. """
+        macros = self.profiles[name]
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write(dumps(macros.to_data(force=True), filename))
+
+    def sync(self, configs_dir: str) -> None:
+        """ Imports config files that are new or were changed outside of EMacros. """
+        with self.lock:
+            updated = dict(self.db.execute('SELECT source, updated FROM profiles WHERE source IS NOT NULL'))
+        for file in os.listdir(configs_dir):
+            if not file.endswith(config_extensions):
+                continue
+            filename = os.path.join(configs_dir, file)
+            if os.stat(filename).st_mtime <= updated.get(filename, 0):
+                continue
+            try:
+                self.import_yaml(filename)
+            except Exception:
+                logging.exception(f'Failed to import {filename} into the profile store')